@@ -1,30 +1,98 @@
 import os
 import io
 import time
+import re
+import json
+import hashlib
+import uuid
+import random
 import base64
-import requests
+import queue
+import threading
+import unicodedata
+import sqlite3
 import gc
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import math
+import functools
+import bisect
+import tracemalloc
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, stream_with_context, send_from_directory, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
-from PIL import Image
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.exceptions import RequestEntityTooLarge
 
-import google.generativeai as genai
-from deep_translator import GoogleTranslator
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_key_123')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///site.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_size': 5,
-    'pool_recycle': 300,
+    # SQLite는 파일 잠금으로 동시성을 처리하므로 풀 크기보다 잠금 대기 시간이 중요하다.
+    'connect_args': {'timeout': 15},
 }
-app.config['UPLOAD_FOLDER'] = 'static/pet_images'
+app.config['CHAT_PAGE_SIZE'] = int(os.getenv('CHAT_PAGE_SIZE', 30))
+# 대화 내보내기/가져오기: 한 번에 읽고 쓰는 메시지 수
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# 가져오기 파일 전체 / 한 줄(이미지 줄 포함) 최대 크기(바이트)
+app.config['IMPORT_MAX_BYTES'] = int(os.getenv('IMPORT_MAX_BYTES', 64 * 1024 * 1024))
+app.config['IMPORT_MAX_LINE_BYTES'] = int(os.getenv('IMPORT_MAX_LINE_BYTES', 16 * 1024 * 1024))
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'static/pet_images')
+# 원본 PNG 외에 이 너비들로 WebP(가능하면 AVIF도) 변형을 만든다.
+app.config['IMAGE_FLIGHTS_MAX'] = int(os.getenv('IMAGE_FLIGHTS_MAX', 2))
+app.config['IMAGE_FLIGHT_FAILED_TTL'] = float(os.getenv('IMAGE_FLIGHT_FAILED_TTL', 60))
+app.config['IMAGE_WIDTHS'] = tuple(int(w) for w in os.getenv('IMAGE_WIDTHS', '160,320,480,960').split(','))
+# 펫 생성 백그라운드 작업 (번역 → 이미지 → 저장 → 인사)
+app.config['PET_JOB_WORKERS'] = int(os.getenv('PET_JOB_WORKERS', 2))
+app.config['PET_JOB_QUEUE_MAX'] = int(os.getenv('PET_JOB_QUEUE_MAX', 8))
+# 채팅 컨텍스트: 최근 N개 메시지는 그대로, 그 이전은 펫별 요약으로 접는다.
+app.config['CHAT_RECENT_MESSAGES'] = int(os.getenv('CHAT_RECENT_MESSAGES', 20))
+app.config['CHAT_SUMMARY_BATCH'] = int(os.getenv('CHAT_SUMMARY_BATCH', 20))
+app.config['CHAT_SUMMARY_MAX_FOLD'] = int(os.getenv('CHAT_SUMMARY_MAX_FOLD', 200))
+app.config['CHAT_SUMMARY_MAX_CHARS'] = int(os.getenv('CHAT_SUMMARY_MAX_CHARS', 1500))
+app.config['CHAT_CONTEXT_MAX_CHARS'] = int(os.getenv('CHAT_CONTEXT_MAX_CHARS', 12000))
+# 번역 캐시 (프로세스 LRU + SQLite). TRANSLATE_BACKEND=stub 이면 네트워크 없이 원문을 돌려준다.
+app.config['TRANSLATE_BACKEND'] = os.getenv('TRANSLATE_BACKEND', 'google')
+app.config['TRANSLATE_CACHE_SIZE'] = int(os.getenv('TRANSLATE_CACHE_SIZE', 1024))
+app.config['TRANSLATE_WORKERS'] = int(os.getenv('TRANSLATE_WORKERS', 4))
+# 외부 API 재시도 / 서킷 브레이커
+app.config['UPSTREAM_RETRIES'] = int(os.getenv('UPSTREAM_RETRIES', 2))
+app.config['UPSTREAM_BACKOFF_BASE'] = float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.5))
+app.config['UPSTREAM_BACKOFF_MAX'] = float(os.getenv('UPSTREAM_BACKOFF_MAX', 8))
+app.config['BREAKER_FAILURES'] = int(os.getenv('BREAKER_FAILURES', 5))
+app.config['BREAKER_RESET_SECONDS'] = float(os.getenv('BREAKER_RESET_SECONDS', 30))
+app.config['STABILITY_POOL_SIZE'] = int(os.getenv('STABILITY_POOL_SIZE', 4))
+# Gemini 호출 하나의 제한 시간(초). SDK 자체 재시도는 끄고 call_upstream만 재시도한다.
+app.config['GEMINI_TIMEOUT'] = float(os.getenv('GEMINI_TIMEOUT', 30))
+# /metrics: METRICS_TOKEN이 있으면 Bearer 토큰을 요구한다. tracemalloc은 오버헤드가 있어 기본은 꺼둔다.
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['METRICS_TRACEMALLOC'] = os.getenv('METRICS_TRACEMALLOC', '0') == '1'
+# 비싼 엔드포인트 입장 제어. rate는 초당 토큰, burst는 버킷 크기.
+# upstream=True 인 엔드포인트는 요청 스레드에서 외부 API를 부르므로 전역 동시 실행 수도 제한한다.
+# ADMISSION_LIMITS='{"chat": {"rate": 1, "burst": 10}}' 처럼 JSON으로 덮어쓸 수 있다.
+app.config['ADMISSION_LIMITS'] = {
+    'create_pet': {'rate': 1 / 60, 'burst': 3, 'upstream': False},
+    'chat': {'rate': 0.5, 'burst': 5, 'upstream': True},
+    'generate_image': {'rate': 1 / 30, 'burst': 3, 'upstream': False},
+    'import_pet': {'rate': 1 / 60, 'burst': 3, 'upstream': False},
+}
+for _endpoint, _limits in json.loads(os.getenv('ADMISSION_LIMITS', '{}')).items():
+    app.config['ADMISSION_LIMITS'].setdefault(_endpoint, {}).update(_limits)
+app.config['ADMISSION_BACKEND'] = os.getenv('ADMISSION_BACKEND', 'memory')  # memory | sqlite
+app.config['UPSTREAM_CONCURRENCY'] = int(os.getenv('UPSTREAM_CONCURRENCY', 3))
+app.config['UPSTREAM_USER_INFLIGHT'] = int(os.getenv('UPSTREAM_USER_INFLIGHT', 1))
+app.config['ADMISSION_QUEUE_MAX'] = int(os.getenv('ADMISSION_QUEUE_MAX', 4))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 5))
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db = SQLAlchemy(app)
@@ -34,13 +102,52 @@ login_manager.login_view = 'login'
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 STABILITY_API_KEY = os.getenv("STABILITY_API_KEY")
+STABILITY_API_URL = os.getenv("STABILITY_API_URL", "https://api.stability.ai/v2beta/stable-image/generate/core")
 
 if not GOOGLE_API_KEY or not STABILITY_API_KEY:
     print("⚠️ WARNING: API 키가 설정되지 않았습니다.")
 
-genai.configure(api_key=GOOGLE_API_KEY)
 CHAT_MODEL_NAME = "models/gemini-pro-latest"
 
+# ---------------------------------------------------------------------------
+# 지연 import
+# google.generativeai(약 1초), deep_translator, PIL, requests는 처음 쓰는
+# 라우트에서 불러온다. 그래서 worker가 뜨자마자 /login 같은 가벼운 페이지를
+# 바로 내보낼 수 있다. WARMUP_ON_BOOT=1(기본)이면 worker 부팅 후
+# 백그라운드에서 미리 불러 둔다.
+# ---------------------------------------------------------------------------
+_genai = None
+_import_lock = threading.Lock()
+
+
+def get_genai():
+    global _genai
+    with _import_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY)
+            _genai = genai
+        return _genai
+
+
+def warm_up():
+    """무거운 SDK와 클라이언트를 미리 불러 첫 사용자 요청이 기다리지 않게 한다."""
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            get_chat_model()
+            get_stability_session()
+            image_formats()
+            import deep_translator  # noqa: F401
+        print(f"워밍업 완료: {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"워밍업 오류: {e}")
+
+
+def start_warm_up():
+    if os.getenv('WARMUP_ON_BOOT', '1') == '1':
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,62 +166,1573 @@ class Pet(db.Model):
     background = db.Column(db.String(100))
     image_file = db.Column(db.String(100), nullable=False, default='default.jpg')
     persona_prompt = db.Column(db.Text)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    history_summary = db.Column(db.Text)
+    summary_upto = db.Column(db.Integer, nullable=False, default=0)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     chat_history = db.relationship('ChatHistory', backref='pet', lazy=True, cascade="all, delete-orphan")
 
 
 class ChatHistory(db.Model):
+    __table_args__ = (db.Index('ix_chat_history_pet_id_id', 'pet_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(10), nullable=False)
     content = db.Column(db.Text, nullable=False)
     pet_id = db.Column(db.Integer, db.ForeignKey('pet.id'), nullable=False)
 
 
+class PetJob(db.Model):
+    """펫 생성 작업. 단계별 결과를 저장해 worker 재시작 후 이어서 실행한다."""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    payload = db.Column(db.Text, nullable=False)
+    translated = db.Column(db.Text)
+    image_file = db.Column(db.String(100))
+    pet_id = db.Column(db.Integer)
+    first_message = db.Column(db.Text)
+    error = db.Column(db.Text)
+    worker_pid = db.Column(db.Integer)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    updated_at = db.Column(db.Float, nullable=False, default=time.time, onupdate=time.time)
+
+
+class TranslationCache(db.Model):
+    source = db.Column(db.String(200), primary_key=True)
+    translated = db.Column(db.String(500), nullable=False)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+
+class RateBucket(db.Model):
+    key = db.Column(db.String(100), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: 읽기와 쓰기가 서로 막지 않는다. NORMAL은 WAL에서 안전하면서 fsync를 줄인다.
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=15000")
+    cursor.execute("PRAGMA cache_size=-8000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=67108864")
+    cursor.close()
+
+
+# ---------------------------------------------------------------------------
+# 스키마 마이그레이션
+# create_all은 새 테이블만 만들고 기존 테이블은 건드리지 않는다.
+# 기존 instance/site.db를 위해 PRAGMA user_version에 적용한 단계를 기록하고
+# 남은 단계만 실행한다. 각 단계는 여러 번 실행해도 안전해야 한다.
+# ---------------------------------------------------------------------------
+def _add_column(conn, table, column, ddl):
+    existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _migrate_history_summary(conn):
+    _add_column(conn, 'pet', 'history_summary', 'TEXT')
+    _add_column(conn, 'pet', 'summary_upto', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _migrate_indexes(conn):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_chat_history_pet_id_id ON chat_history (pet_id, id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_pet_user_id ON pet (user_id)")
+    conn.exec_driver_sql("ANALYZE")
+
+
+MIGRATIONS = [
+    _migrate_history_summary,
+    _migrate_indexes,
+]
+
+
+def init_db():
+    """테이블을 만들고 남은 마이그레이션을 적용한다. 적용 후 스키마 버전을 돌려준다."""
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+                migrate(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+                print(f"DB 마이그레이션 {number} 적용: {migrate.__name__}")
+        # preload_app이면 여기는 gunicorn master에서 돈다. SQLite 연결은 fork를 넘어가면 안 되므로
+        # 풀을 비워 두고 worker마다 새로 연결하게 한다.
+        db.engine.dispose()
+        return len(MIGRATIONS)
+
+
+@app.cli.command('migrate-db')
+def migrate_db():
+    """instance/site.db 스키마를 최신으로 맞춘다."""
+    print(f"스키마 버전: {init_db()}")
+
+
+# ---------------------------------------------------------------------------
+# 계측
+# 요청마다 전체 시간과 DB / Gemini / Stability / 번역 시간을 나눠 기록하고,
+# RSS(와 켜져 있으면 tracemalloc) 변화량을 히스토그램으로 모아 /metrics에
+# Prometheus 텍스트 형식으로 내보낸다. 값은 worker 프로세스별이다.
+# gc 콜백으로 GC 횟수와 멈춘 시간도 재서 강제 gc.collect()의 비용을 본다.
+# ---------------------------------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MEMORY_BUCKETS = (-1 << 20, 0, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20)
+GC_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(labels, {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0})
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ['+Inf'], series['counts']):
+                    cumulative += count
+                    le = _format_labels(self.labelnames, labels, [('le', bound)])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                base = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{base} {series['sum']}")
+                lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+REQUESTS_TOTAL = Counter('remempet_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('remempet_request_seconds', 'Request wall time.', ('endpoint',))
+REQUEST_COMPONENT_SECONDS = Histogram(
+    'remempet_request_component_seconds', 'Per-request time spent in db/gemini/stability/translation.',
+    ('endpoint', 'component'))
+UPSTREAM_SECONDS = Histogram(
+    'remempet_upstream_seconds', 'Upstream call time, including background jobs.', ('service',))
+REQUEST_RSS_DELTA = Histogram(
+    'remempet_request_rss_delta_bytes', 'RSS change across a request.', ('endpoint',), MEMORY_BUCKETS)
+REQUEST_TRACEMALLOC_DELTA = Histogram(
+    'remempet_request_tracemalloc_delta_bytes', 'Traced Python allocation change across a request.',
+    ('endpoint',), MEMORY_BUCKETS)
+CHAT_TTFT_SECONDS = Histogram(
+    'remempet_chat_ttft_seconds', 'Streamed chat time to first token (total time is in remempet_request_seconds).')
+GC_PAUSE_SECONDS = Histogram('remempet_gc_pause_seconds', 'Garbage collector pause time.', ('generation',), GC_BUCKETS)
+
+PROCESS_STARTED = time.time()
+_request_local = threading.local()
+_gc_started = {}
+_gc_pauses = deque(maxlen=10000)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def record_timing(component, seconds):
+    """현재 요청의 구성 요소별 시간에 더한다. 외부 API는 요청 밖(백그라운드)에서도 기록한다."""
+    timings = getattr(_request_local, 'timings', None)
+    if timings is not None:
+        timings[component] = timings.get(component, 0.0) + seconds
+    if component != 'db':
+        UPSTREAM_SECONDS.observe(seconds, component)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None:
+        record_timing('db', time.perf_counter() - started)
+
+
+def _gc_callback(phase, info):
+    if phase == 'start':
+        _gc_started[threading.get_ident()] = time.perf_counter()
+    else:
+        started = _gc_started.pop(threading.get_ident(), None)
+        if started is not None:
+            # 여기서 락을 잡으면 observe/render가 락을 쥔 채 할당하다 GC가 돌 때 같은 스레드에서
+            # 교착된다. deque.append는 락 없이 원자적이므로 쌓아 두고 수집할 때 히스토그램에 넣는다.
+            _gc_pauses.append((info['generation'], time.perf_counter() - started))
+
+
+def _flush_gc_pauses():
+    # 넣는 동안 일어난 GC가 계속 쌓이므로 지금 있는 만큼만 옮긴다.
+    for _ in range(len(_gc_pauses)):
+        generation, seconds = _gc_pauses.popleft()
+        GC_PAUSE_SECONDS.observe(seconds, generation)
+
+
+gc.callbacks.append(_gc_callback)
+if app.config['METRICS_TRACEMALLOC'] and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+@app.before_request
+def _start_request_metrics():
+    _request_local.timings = {}
+    g.metrics_started = time.perf_counter()
+    g.metrics_rss = _rss_bytes()
+    if tracemalloc.is_tracing():
+        g.metrics_traced = tracemalloc.get_traced_memory()[0]
+
+
+@app.after_request
+def _add_server_timing(response):
+    g.metrics_status = response.status_code
+    if response.is_streamed:
+        # 스트리밍 응답은 헤더가 먼저 나가므로 Server-Timing을 붙이지 않고,
+        # 본문이 다 나간 뒤(call_on_close)에 한 번만 기록한다. teardown은 헤더를 보낼 때와
+        # stream_with_context가 끝날 때 두 번 불리므로 여기서는 건너뛴다.
+        if 'metrics_started' in g:
+            g.metrics_streamed = True
+            response.call_on_close(functools.partial(
+                _record_request_metrics, _metrics_endpoint(), request.method, response.status_code,
+                g.metrics_started, g.metrics_rss, g.get('metrics_traced')))
+        return response
+    timings = getattr(_request_local, 'timings', None) or {}
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in sorted(timings.items())]
+    if 'metrics_started' in g:
+        parts.append(f"total;dur={(time.perf_counter() - g.metrics_started) * 1000:.1f}")
+    response.headers['Server-Timing'] = ", ".join(parts)
+    return response
+
+
+def _metrics_endpoint():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _record_request_metrics(endpoint, method, status, started, rss, traced):
+    timings = getattr(_request_local, 'timings', None)
+    _request_local.timings = None
+    REQUESTS_TOTAL.inc(endpoint, method, status)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+    for component, seconds in (timings or {}).items():
+        REQUEST_COMPONENT_SECONDS.observe(seconds, endpoint, component)
+    REQUEST_RSS_DELTA.observe(_rss_bytes() - rss, endpoint)
+    if tracemalloc.is_tracing() and traced is not None:
+        REQUEST_TRACEMALLOC_DELTA.observe(tracemalloc.get_traced_memory()[0] - traced, endpoint)
+
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    if 'metrics_started' not in g:
+        _request_local.timings = None
+        return
+    if g.get('metrics_streamed'):
+        return
+    _record_request_metrics(_metrics_endpoint(), request.method, g.get('metrics_status', 500),
+                            g.metrics_started, g.metrics_rss, g.get('metrics_traced'))
+
+
+def _gauge(name, help_text, samples, kind='gauge'):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels([k for k, _ in labels], [v for _, v in labels])} {value}")
+    return lines
+
+
+@app.route("/metrics")
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+
+    _flush_gc_pauses()
+    lines = []
+    for metric in (REQUESTS_TOTAL, ADMISSION_REJECTED, REQUEST_SECONDS, REQUEST_COMPONENT_SECONDS, UPSTREAM_SECONDS,
+                   CHAT_TTFT_SECONDS, REQUEST_RSS_DELTA, REQUEST_TRACEMALLOC_DELTA, GC_PAUSE_SECONDS):
+        lines += metric.render()
+    lines += _gauge('process_resident_memory_bytes', 'Resident memory size.', [((), _rss_bytes())])
+    lines += _gauge('process_start_time_seconds', 'Worker start time.', [((), PROCESS_STARTED)])
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines += _gauge('remempet_tracemalloc_bytes', 'Traced Python allocations.',
+                        [((('kind', 'current'),), current), ((('kind', 'peak'),), peak)])
+    lines += _gauge('python_gc_collections_total', 'GC collections per generation.',
+                    [((('generation', i),), stat['collections']) for i, stat in enumerate(gc.get_stats())],
+                    kind='counter')
+    lines += _gauge('remempet_translate_cache_total', 'Translation cache lookups by result.',
+                    [((('result', k),), v) for k, v in sorted(translate_stats.items())], kind='counter')
+    lines += _gauge('remempet_circuit_open', 'Circuit breaker state (0 closed, 1 half-open, 2 open).',
+                    [((('service', b.name.lower()),), {'closed': 0, 'half-open': 1, 'open': 2}[b.state])
+                     for b in (stability_breaker, gemini_breaker)])
+    return Response("\n".join(lines) + "\n", mimetype='text/plain; version=0.0.4')
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 
-def translate(text):
-    if not text:
-        return ""
+# ---------------------------------------------------------------------------
+# 번역 캐시
+# 종/색/음식/장소는 사용자끼리 겹치는 값이 많아서, 정규화한 원문을 키로
+# 프로세스 LRU → SQLite → 번역기 순서로 찾는다. SQLite에 남기 때문에
+# worker가 재시작돼도 캐시가 유지된다.
+# ---------------------------------------------------------------------------
+_translate_lru = OrderedDict()
+_translate_lock = threading.Lock()
+_translate_local = threading.local()
+_translate_executor = None
+translate_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'errors': 0}
+
+
+def _google_translate(text):
+    # GoogleTranslator는 요청마다 내부 상태를 바꾸므로 스레드마다 하나씩 쓴다.
+    translator = getattr(_translate_local, 'translator', None)
+    if translator is None:
+        from deep_translator import GoogleTranslator
+        translator = _translate_local.translator = GoogleTranslator(source='auto', target='en')
+    return translator.translate(text=text)
+
+
+TRANSLATE_BACKENDS = {
+    'google': _google_translate,
+    'stub': lambda text: text,
+}
+
+
+def set_translate_backend(func):
+    """번역기를 교체한다. 테스트/벤치마크에서 네트워크 없이 돌릴 때 사용."""
+    TRANSLATE_BACKENDS['custom'] = func
+    app.config['TRANSLATE_BACKEND'] = 'custom'
+
+
+def _normalize_source(text):
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+
+def _lru_get(key):
+    with _translate_lock:
+        if key in _translate_lru:
+            _translate_lru.move_to_end(key)
+            return _translate_lru[key]
+    return None
+
+
+def _lru_put(key, value):
+    with _translate_lock:
+        _translate_lru[key] = value
+        _translate_lru.move_to_end(key)
+        while len(_translate_lru) > app.config['TRANSLATE_CACHE_SIZE']:
+            _translate_lru.popitem(last=False)
+
+
+def _count(name, n=1):
+    with _translate_lock:
+        translate_stats[name] += n
+
+
+def _translate_upstream(text):
     try:
-        return GoogleTranslator(source='auto', target='en').translate(text=text)
-    except:
-        return text
+        return TRANSLATE_BACKENDS[app.config['TRANSLATE_BACKEND']](text)
+    except Exception as e:
+        print(f"번역 오류: {e}")
+        return None
 
 
-def generate_image_stability_v2(prompt):
-    """Stability AI v2 API"""
-    url = "https://api.stability.ai/v2beta/stable-image/generate/core"
-    
-    headers = {
-        "Authorization": f"Bearer {STABILITY_API_KEY}",
-        "Accept": "image/*"
-    }
-    
+def _get_translate_executor():
+    global _translate_executor
+    with _translate_lock:
+        if _translate_executor is None:
+            _translate_executor = ThreadPoolExecutor(
+                max_workers=app.config['TRANSLATE_WORKERS'], thread_name_prefix='translate')
+        return _translate_executor
+
+
+def translate_many(texts):
+    """여러 값을 한 번에 번역한다. 캐시에 없는 값들은 동시에 번역기로 보낸다."""
+    keys = [_normalize_source(t) if t else "" for t in texts]
+    found = {"": ""}
+    missing = []
+    for key in dict.fromkeys(keys):
+        if key in found:
+            continue
+        cached = _lru_get(key)
+        if cached is not None:
+            found[key] = cached
+            _count('memory_hits')
+        else:
+            missing.append(key)
+
+    if missing:
+        rows = TranslationCache.query.filter(TranslationCache.source.in_(missing)).all()
+        for row in rows:
+            found[row.source] = row.translated
+            _lru_put(row.source, row.translated)
+        _count('db_hits', len(rows))
+        missing = [k for k in missing if k not in found]
+
+    if missing:
+        _count('misses', len(missing))
+        started = time.perf_counter()
+        results = list(_get_translate_executor().map(_translate_upstream, missing))
+        record_timing('translation', time.perf_counter() - started)
+        new_rows = []
+        for key, value in zip(missing, results):
+            if value is None:
+                # 실패한 번역은 캐시하지 않고 원문을 그대로 쓴다.
+                _count('errors')
+                found[key] = key
+                continue
+            found[key] = value
+            _lru_put(key, value)
+            new_rows.append({'source': key, 'translated': value, 'created_at': time.time()})
+        if new_rows:
+            db.session.execute(sqlite_insert(TranslationCache).values(new_rows).on_conflict_do_nothing())
+            db.session.commit()
+
+    return [found[k] for k in keys]
+
+
+def translate(text):
+    return translate_many([text])[0]
+
+
+# ---------------------------------------------------------------------------
+# 외부 API 클라이언트
+# Stability는 keep-alive 세션 하나를, Gemini는 모델 핸들 하나를 재사용한다.
+# 429/5xx는 지터를 준 지수 백오프로 재시도하고, 연속으로 실패하면
+# 서킷을 열어 타임아웃까지 기다리지 않고 바로 실패시킨다.
+# ---------------------------------------------------------------------------
+class UpstreamError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """closed → (연속 실패) → open → (reset 시간 경과) → half-open에서 한 번 시험 호출."""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self.opened_at >= app.config['BREAKER_RESET_SECONDS']:
+                self.state = 'half-open'
+            if self.state == 'half-open' and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(f"{self.name} 서비스에 잠시 연결할 수 없어요. 조금 뒤에 다시 시도해주세요.")
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half-open' or self.failures >= app.config['BREAKER_FAILURES']:
+                if self.state != 'open':
+                    print(f"⚠️ {self.name} 서킷 열림 (연속 실패 {self.failures}회)")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+stability_breaker = CircuitBreaker('Stability')
+gemini_breaker = CircuitBreaker('Gemini')
+
+
+def call_upstream(breaker, func, is_retryable, is_failure=None):
+    """func를 재시도/서킷 브레이커로 감싸 호출한다. 재시도할 수 없는 오류는 바로 올린다.
+
+    is_failure는 서킷 브레이커에 장애로 셀 오류인지 판단한다 (기본: is_retryable과 같음).
+    읽기 타임아웃처럼 다시 시도하지는 않지만 장애로는 세야 하는 경우에 따로 준다.
+    """
+    is_failure = is_failure or is_retryable
+    retries = app.config['UPSTREAM_RETRIES']
+    for attempt in range(retries + 1):
+        breaker.before_call()
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            record_timing(breaker.name.lower(), time.perf_counter() - started)
+            if not is_failure(e):
+                # 요청 자체의 문제(4xx 등)는 서비스 장애로 세지 않는다.
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(app.config['UPSTREAM_BACKOFF_MAX'],
+                                          app.config['UPSTREAM_BACKOFF_BASE'] * 2 ** attempt))
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after:
+                delay = min(max(delay, retry_after), app.config['UPSTREAM_BACKOFF_MAX'])
+            print(f"{breaker.name} 재시도 {attempt + 1}/{retries} ({delay:.1f}s 후): {e}")
+            time.sleep(delay)
+        else:
+            record_timing(breaker.name.lower(), time.perf_counter() - started)
+            breaker.record_success()
+            return result
+
+
+_stability_session = None
+_chat_model = None
+_client_lock = threading.Lock()
+
+
+def get_stability_session():
+    # fork 이후 worker 안에서 만들어야 연결이 프로세스끼리 공유되지 않는다.
+    global _stability_session
+    with _client_lock:
+        if _stability_session is None:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=app.config['STABILITY_POOL_SIZE'])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Authorization": f"Bearer {STABILITY_API_KEY}",
+                "Accept": "image/*"
+            })
+            _stability_session = session
+        return _stability_session
+
+
+def get_chat_model():
+    global _chat_model
+    with _client_lock:
+        if _chat_model is None:
+            _chat_model = get_genai().GenerativeModel(CHAT_MODEL_NAME)
+        return _chat_model
+
+
+def set_chat_model(model):
+    """Gemini 모델 핸들을 교체한다. 테스트/벤치마크에서 가짜 모델을 끼울 때 사용."""
+    global _chat_model
+    with _client_lock:
+        _chat_model = model
+
+
+def _stability_retryable(e):
+    if isinstance(e, UpstreamError):
+        return e.status == 429 or (e.status or 0) >= 500
+    # 읽기 타임아웃은 이미 120초를 기다린 것이므로 다시 시도하지 않는다.
+    import requests
+    return isinstance(e, (requests.ConnectionError, requests.exceptions.ConnectTimeout))
+
+
+def _stability_failure(e):
+    # 4xx(429 제외)만 요청 쪽 문제로 보고, 타임아웃을 포함한 나머지는 모두 장애로 센다.
+    if isinstance(e, UpstreamError) and e.status and 400 <= e.status < 500:
+        return e.status == 429
+    return True
+
+
+def _gemini_retryable(e):
+    from google.api_core import exceptions as google_exceptions
+    # 제한 시간을 넘긴 호출은 Stability 읽기 타임아웃처럼 다시 시도하지 않는다 (장애로는 센다).
+    if isinstance(e, google_exceptions.DeadlineExceeded):
+        return False
+    return isinstance(e, (google_exceptions.TooManyRequests, google_exceptions.ServerError))
+
+
+def _gemini_failure(e):
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(e, (google_exceptions.TooManyRequests, google_exceptions.ServerError))
+
+
+def gemini_options():
+    """SDK 기본값(timeout 600초, 503 자동 재시도)은 서킷 브레이커보다 훨씬 오래 붙잡고 있으므로 끈다."""
+    return {'timeout': app.config['GEMINI_TIMEOUT'], 'retry': None}
+
+
+def gemini_call(func):
+    return call_upstream(gemini_breaker, func, _gemini_retryable, _gemini_failure)
+
+
+def _post_stability(prompt):
     files = {
         "prompt": (None, prompt),
         "output_format": (None, "png"),
         "aspect_ratio": (None, "1:1")
     }
-    
+    response = get_stability_session().post(STABILITY_API_URL, files=files, timeout=(10, 120))
+    if response.status_code != 200:
+        retry_after = response.headers.get("Retry-After", "")
+        raise UpstreamError(
+            f"Stability API Error: {response.status_code} - {response.text}",
+            status=response.status_code,
+            retry_after=float(retry_after) if retry_after.isdigit() else None)
+    return response.content
+
+
+def generate_image_stability_v2(prompt):
+    """Stability AI v2 API"""
     try:
-        response = requests.post(url, headers=headers, files=files, timeout=120)
-        
-        if response.status_code != 200:
-            raise Exception(f"Stability API Error: {response.status_code} - {response.text}")
-        
-        image_data = response.content
-        
-        del response
+        return call_upstream(stability_breaker, lambda: _post_stability(prompt),
+                             _stability_retryable, _stability_failure)
+    finally:
         gc.collect()
-        
-        return image_data
-        
+
+
+def build_image_prompt(t, age):
+    """t: 번역된 breed/color/food/background"""
+    return (
+        f"A highly detailed 3D render of a cute {t['color']} {t['breed']} dog, {age} years old. "
+        f"The dog is eating {t['food']} in a {t['background']} setting. "
+        "Pixar style, Disney animation style, octane render, 8k, soft lighting, happy expression."
+    )
+
+
+def build_persona_prompt(name, breed, color, age, food):
+    return f"""당신은 하늘나라에 있는 반려견 '{name}'입니다. 종:{breed}, 색:{color}, 나이:{age}, 좋아하는 음식:{food}. 주인과 다시 만나서 너무 기쁘고, 보고 싶었던 마음을 표현합니다. 반말로 다정하고 그리워하는 톤으로 대화해주세요. '하늘나라', '무지개다리', '별나라' 같은 표현을 자연스럽게 사용하세요."""
+
+
+# ---------------------------------------------------------------------------
+# 펫 생성 작업 파이프라인
+# 요청 스레드는 PetJob만 만들고 바로 반환하고, 번역/이미지/저장/인사는
+# 크기가 제한된 작업 스레드에서 실행한다. 단계 결과는 SQLite에 남겨서
+# max_requests 재시작으로 worker가 바뀌어도 남은 단계부터 이어간다.
+# 작업이 도는 동안은 gunicorn pre_request 훅이 max_requests 재시작을 얼마간 미룬다.
+# worker가 종료될 때는 기다리지 않는다 (workers=1이라 기다리는 동안 사이트가 멈춘다).
+# 새 단계는 시작하지 않고, 실행 중이던 단계는 daemon 스레드와 함께 끊겨 다음 worker가
+# 그 단계부터 다시 실행한다. Stability 응답은 받자마자 jobs/{job_id}.png로 남겨 두므로
+# 인코딩/저장 중에 끊겨도 다시 과금되지 않는다 (요청이 아직 진행 중이었다면 다시 보낸다).
+# ---------------------------------------------------------------------------
+PET_JOB_FINISHED = ('done', 'failed')
+
+_pet_job_queue = queue.Queue()
+_pet_job_slots = None
+_pet_job_lock = threading.Lock()
+_pet_jobs_stopping = threading.Event()
+_pet_jobs_running = 0
+
+
+class _PetJobStopped(Exception):
+    pass
+
+
+def _pet_job_worker():
+    global _pet_jobs_running
+    while True:
+        job_id = _pet_job_queue.get()
+        if _pet_jobs_stopping.is_set():
+            # 종료 중이면 시작하지 않는다. worker_pid가 그대로 남아 다음 worker가 이어받는다.
+            _pet_job_slots.release()
+            continue
+        with _pet_job_lock:
+            _pet_jobs_running += 1
+        try:
+            _run_pet_job(job_id)
+        finally:
+            with _pet_job_lock:
+                _pet_jobs_running -= 1
+
+
+def _get_pet_job_slots():
+    # preload_app 환경에서는 fork 이후 worker 안에서 만들어야 스레드가 살아있다.
+    global _pet_job_slots
+    with _pet_job_lock:
+        if _pet_job_slots is None:
+            for i in range(app.config['PET_JOB_WORKERS']):
+                threading.Thread(target=_pet_job_worker, name=f'pet-job-{i}', daemon=True).start()
+            _pet_job_slots = threading.BoundedSemaphore(app.config['PET_JOB_QUEUE_MAX'])
+        return _pet_job_slots
+
+
+def pet_jobs_running():
+    """이 프로세스에서 실행 중인 펫 생성 작업 수"""
+    return _pet_jobs_running
+
+
+def stop_pet_jobs(worker_pid):
+    """worker 종료 시 호출. 이 프로세스에서 새 단계를 시작하지 않게 하고 바로 돌아온다.
+
+    gunicorn은 master에서도 worker_exit를 부를 수 있다. master에 표시가 남으면 이후 fork된
+    worker가 모두 물려받아 작업을 못 하므로, 해당 worker 프로세스 안에서만 표시한다.
+    """
+    if os.getpid() == worker_pid:
+        _pet_jobs_stopping.set()
+
+
+def _job_image_path(job_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'jobs', f"{job_id}.png")
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def submit_pet_job(job_id, owner_pid):
+    """owner_pid에서 현재 프로세스로 작업을 가져와 실행을 예약한다. 자리가 없으면 False."""
+    slots = _get_pet_job_slots()
+    if not slots.acquire(blocking=False):
+        return False
+
+    # 여러 스레드가 같은 작업을 이어받지 않도록 worker_pid를 조건부로 갱신한다.
+    claimed = PetJob.query.filter_by(id=job_id, worker_pid=owner_pid).update(
+        {'worker_pid': os.getpid()}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        slots.release()
+        return True
+
+    _pet_job_queue.put(job_id)
+    return True
+
+
+def resume_pet_jobs():
+    """끝나지 않은 작업 중 주인 worker가 없는 것을 다시 실행한다. worker 부팅 시 호출."""
+    with app.app_context():
+        pending = PetJob.query.filter(PetJob.status.notin_(PET_JOB_FINISHED)).all()
+        for job in pending:
+            if job.worker_pid != os.getpid() and not _pid_alive(job.worker_pid):
+                if not submit_pet_job(job.id, job.worker_pid):
+                    break
+
+
+def _set_job_status(job, status):
+    # 단계 경계마다 불리므로 여기서 종료 요청을 확인한다.
+    if _pet_jobs_stopping.is_set():
+        raise _PetJobStopped()
+    job.status = status
+    db.session.commit()
+
+
+def _run_pet_job(job_id):
+    with app.app_context():
+        try:
+            _run_pet_job_stages(db.session.get(PetJob, job_id))
+        except _PetJobStopped:
+            print(f"worker 종료로 작업 {job_id}을 다음 worker에 넘깁니다.")
+            db.session.rollback()
+        except Exception as e:
+            print(f"생성 오류: {e}")
+            db.session.rollback()
+            job = db.session.get(PetJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            db.session.commit()
+        finally:
+            db.session.remove()
+            _pet_job_slots.release()
+            gc.collect()
+
+
+def _run_pet_job_stages(job):
+    data = json.loads(job.payload)
+    name, breed, color, age = data['name'], data['breed'], data['color'], data['age']
+    food, bg = data.get('favorite_food'), data.get('background')
+
+    if job.translated is None:
+        _set_job_status(job, 'translating')
+        t_breed, t_color, t_food, t_bg = translate_many([breed, color, food, bg])
+        job.translated = json.dumps({
+            'breed': t_breed, 'color': t_color, 'food': t_food, 'background': t_bg,
+        }, ensure_ascii=False)
+        db.session.commit()
+    t = json.loads(job.translated)
+
+    if not job.image_file:
+        _set_job_status(job, 'generating')
+        raw_path = _job_image_path(job.id)
+        if os.path.exists(raw_path):
+            # 이전 worker가 받아 두고 저장하기 전에 끊긴 이미지
+            with open(raw_path, 'rb') as f:
+                image_bytes = f.read()
+        else:
+            image_bytes = generate_image_stability_v2(build_image_prompt(t, age))
+            if not image_bytes:
+                raise Exception("이미지 데이터를 받아오지 못했습니다.")
+            def write_raw(path):
+                with open(path, 'wb') as f:
+                    f.write(image_bytes)
+            os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+            _write_atomic(raw_path, write_raw)
+
+        job.image_file = save_pet_image(image_bytes)
+        db.session.commit()
+        os.remove(raw_path)
+
+    if not job.pet_id:
+        _set_job_status(job, 'saving')
+        new_pet = Pet(
+            name=name, breed=breed, color=color, age=age,
+            favorite_food=food, background=bg, image_file=job.image_file,
+            persona_prompt=build_persona_prompt(name, breed, color, age, food),
+            user_id=job.user_id
+        )
+        db.session.add(new_pet)
+        db.session.flush()
+        job.pet_id = new_pet.id
+        db.session.commit()
+
+    _set_job_status(job, 'greeting')
+    pet = db.session.get(Pet, job.pet_id)
+    greeting_history = [
+        {"role": "user", "parts": [pet.persona_prompt]},
+        {"role": "model", "parts": [f"안녕! 나 {name}야!"]}
+    ]
+    first_msg = gemini_call(lambda: get_chat_model().start_chat(history=greeting_history).send_message(
+        f"'{name}'으로서, 하늘나라에서 오랜만에 주인을 만난 기쁨을 반말로 따뜻하게 표현해줘. 보고 싶었다는 마음을 담아서.",
+        request_options=gemini_options())).text
+
+    db.session.add(ChatHistory(role='model', content=first_msg, pet_id=pet.id))
+    job.first_message = first_msg
+    job.status = 'done'
+    db.session.commit()
+
+
+# ---------------------------------------------------------------------------
+# 채팅 컨텍스트 관리
+# 매 요청마다 전체 기록을 보내지 않고 페르소나 + 요약 + 최근 메시지만 보낸다.
+# 최근 창 밖으로 밀려난 메시지는 백그라운드에서 Pet.history_summary에
+# 조금씩 접어 넣고, summary_upto에 어디까지 요약했는지 기록한다.
+# ---------------------------------------------------------------------------
+_summary_executor = None
+_summary_pending = set()
+_summary_lock = threading.Lock()
+
+
+def build_chat_context(pet, msg=""):
+    """Gemini에 보낼 history를 만든다. 전체 크기는 CHAT_CONTEXT_MAX_CHARS 이내로 맞춘다."""
+    recent = (ChatHistory.query
+              .filter(ChatHistory.pet_id == pet.id, ChatHistory.id > pet.summary_upto)
+              .order_by(ChatHistory.id.desc())
+              .limit(app.config['CHAT_RECENT_MESSAGES'])
+              .all())
+    recent.reverse()
+
+    gemini_history = [
+        {"role": "user", "parts": [pet.persona_prompt]},
+        {"role": "model", "parts": ["알겠어!"]}
+    ]
+    if pet.history_summary:
+        gemini_history += [
+            {"role": "user", "parts": [f"(지금까지 우리가 나눈 이야기 요약: {pet.history_summary})"]},
+            {"role": "model", "parts": ["응, 다 기억하고 있어!"]}
+        ]
+
+    # 예산을 넘으면 오래된 메시지부터 뺀다. 빠진 메시지는 나중에 요약에 포함된다.
+    budget = app.config['CHAT_CONTEXT_MAX_CHARS'] - len(msg)
+    budget -= sum(len(part) for h in gemini_history for part in h["parts"])
+    used = sum(len(h.content) for h in recent)
+    while recent and used > budget:
+        used -= len(recent.pop(0).content)
+
+    for h in recent:
+        gemini_history.append({"role": h.role, "parts": [h.content]})
+    return gemini_history
+
+
+def schedule_history_fold(pet_id):
+    """요약되지 않은 메시지가 최근 창 + 배치 크기를 넘으면 백그라운드 요약을 예약한다."""
+    global _summary_executor
+    pet = db.session.get(Pet, pet_id)
+    threshold = app.config['CHAT_RECENT_MESSAGES'] + app.config['CHAT_SUMMARY_BATCH']
+    overflow = (ChatHistory.query
+                .filter(ChatHistory.pet_id == pet_id, ChatHistory.id > pet.summary_upto)
+                .order_by(ChatHistory.id.desc())
+                .offset(threshold)
+                .first())
+    if overflow is None:
+        return
+
+    with _summary_lock:
+        if pet_id in _summary_pending:
+            return
+        _summary_pending.add(pet_id)
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+    _summary_executor.submit(_fold_history, pet_id)
+
+
+def _fold_history(pet_id):
+    with app.app_context():
+        try:
+            fold_history(pet_id)
+        except Exception as e:
+            print(f"요약 오류: {e}")
+        finally:
+            db.session.remove()
+            with _summary_lock:
+                _summary_pending.discard(pet_id)
+            gc.collect()
+
+
+def fold_history(pet_id):
+    """최근 창보다 오래된 메시지를 최대 CHAT_SUMMARY_MAX_FOLD개까지 요약에 합친다."""
+    pet = db.session.get(Pet, pet_id)
+    upto = pet.summary_upto
+    window_start = (ChatHistory.query
+                    .filter(ChatHistory.pet_id == pet_id)
+                    .order_by(ChatHistory.id.desc())
+                    .offset(app.config['CHAT_RECENT_MESSAGES'] - 1)
+                    .first())
+    if window_start is None:
+        return
+
+    rows = (ChatHistory.query
+            .filter(ChatHistory.pet_id == pet_id,
+                    ChatHistory.id > upto, ChatHistory.id < window_start.id)
+            .order_by(ChatHistory.id.asc())
+            .limit(app.config['CHAT_SUMMARY_MAX_FOLD'])
+            .all())
+    if not rows:
+        return
+
+    speaker = {'user': '주인', 'model': pet.name}
+    transcript = "\n".join(f"{speaker.get(h.role, h.role)}: {h.content}" for h in rows)
+    prompt = (
+        f"반려견 '{pet.name}'와(과) 주인의 대화를 요약하고 있어요.\n"
+        f"[기존 요약]\n{pet.history_summary or '(없음)'}\n\n"
+        f"[새 대화]\n{transcript}\n\n"
+        "기존 요약에 새 대화를 합쳐서 요약을 갱신해주세요. 주인이 알려준 사실, 추억, 약속, 감정은 꼭 남겨주세요. "
+        f"{app.config['CHAT_SUMMARY_MAX_CHARS']}자 이내의 한국어 문단 하나로만 답해주세요."
+    )
+    summary = gemini_call(lambda: get_chat_model().generate_content(prompt, request_options=gemini_options())).text.strip()[:app.config['CHAT_SUMMARY_MAX_CHARS']]
+
+    # 그 사이 다른 곳에서 요약이 갱신됐다면 덮어쓰지 않는다.
+    Pet.query.filter_by(id=pet_id, summary_upto=upto).update(
+        {'history_summary': summary, 'summary_upto': rows[-1].id}, synchronize_session=False)
+    db.session.commit()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_chat_reply(pet_id, msg, gemini_history):
+    """Gemini 응답 조각을 SSE로 전달하고, 끝나면 대화를 한 번에 저장한다."""
+    started = time.perf_counter()
+    first_token_at = None
+    parts = []
+    try:
+        # stream=True도 첫 조각을 받을 때까지는 send_message 안에서 기다리므로 그 전까지만 재시도된다.
+        stream = gemini_call(lambda: get_chat_model().start_chat(history=gemini_history).send_message(msg, stream=True, request_options=gemini_options()))
+        for chunk in stream:
+            text = chunk.text
+            if not text:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(text)
+            yield _sse('token', {'text': text})
+
+        reply = "".join(parts)
+        db.session.add(ChatHistory(role='user', content=msg, pet_id=pet_id))
+        db.session.add(ChatHistory(role='model', content=reply, pet_id=pet_id))
+        db.session.commit()
+        schedule_history_fold(pet_id)
+
+        # 사용자가 체감하는 첫 토큰 시간(TTFT)과 전체 시간을 따로 기록한다.
+        total_ms = (time.perf_counter() - started) * 1000
+        ttft_ms = (first_token_at - started) * 1000 if first_token_at else total_ms
+        CHAT_TTFT_SECONDS.observe(ttft_ms / 1000)
+        print(f"채팅 스트림: pet={pet_id} ttft={ttft_ms:.0f}ms total={total_ms:.0f}ms")
+        yield _sse('done', {'reply': reply, 'ttft_ms': round(ttft_ms), 'total_ms': round(total_ms)})
+
     except Exception as e:
+        print(f"채팅 오류: {e}")
+        db.session.rollback()
+        yield _sse('error', {'error': str(e)})
+    finally:
         gc.collect()
-        raise e
+
+
+# ---------------------------------------------------------------------------
+# 이미지 변형
+# 파일 이름을 내용 해시로 정하므로 한 번 만든 파일은 바뀌지 않는다.
+# 그래서 브라우저가 오래 캐시하도록 immutable 헤더를 붙여 내보낸다.
+#   {hash}.png          원본
+#   {hash}_{width}.webp  목록 썸네일 / 채팅 프로필용 (srcset)
+# ---------------------------------------------------------------------------
+HASHED_IMAGE_RE = re.compile(r'^[0-9a-f]{16}(_\d+)?\.(png|webp|avif)$')
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+@functools.lru_cache(maxsize=None)
+def _image_encoders():
+    from PIL import features
+    encoders = [('image/webp', 'webp', 'WEBP', {'quality': 80, 'method': 4})]
+    if features.check('avif'):
+        encoders.insert(0, ('image/avif', 'avif', 'AVIF', {'quality': 60}))
+    return encoders
+
+
+def image_formats():
+    return [(mime, ext) for mime, ext, _, _ in _image_encoders()]
+
+
+def _write_atomic(path, write):
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_pet_image(image_bytes):
+    """원본과 크기별 변형을 저장하고 원본 파일 이름({hash}.png)을 돌려준다."""
+    stem = hashlib.sha256(image_bytes).hexdigest()[:16]
+    folder = app.config['UPLOAD_FOLDER']
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    try:
+        if image.format == 'PNG':
+            def write_original(path):
+                with open(path, 'wb') as f:
+                    f.write(image_bytes)
+        else:
+            def write_original(path):
+                image.save(path, 'PNG')
+        _write_atomic(os.path.join(folder, f"{stem}.png"), write_original)
+
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for width in app.config['IMAGE_WIDTHS']:
+            resized = image.copy()
+            resized.thumbnail((width, width), Image.LANCZOS)
+            for _, ext, fmt, options in _image_encoders():
+                _write_atomic(os.path.join(folder, f"{stem}_{width}.{ext}"),
+                              lambda path: resized.save(path, fmt, **options))
+            resized.close()
+    finally:
+        image.close()
+    return f"{stem}.png"
+
+
+def is_hashed_image(filename):
+    return bool(filename and HASHED_IMAGE_RE.match(filename))
+
+
+def pet_image_url(filename, width=None, ext='webp'):
+    if not is_hashed_image(filename):
+        return url_for('static', filename='pet_images/' + filename)
+    if width is None:
+        return url_for('pet_image', filename=filename)
+    return url_for('pet_image', filename=f"{filename[:-4]}_{width}.{ext}")
+
+
+def pet_image_srcset(filename, ext='webp'):
+    return ", ".join(f"{pet_image_url(filename, w, ext)} {w}w" for w in app.config['IMAGE_WIDTHS'])
+
+
+@app.context_processor
+def image_helpers():
+    return {
+        'is_hashed_image': is_hashed_image,
+        'pet_image_url': pet_image_url,
+        'pet_image_srcset': pet_image_srcset,
+        'image_formats': image_formats,
+        'image_widths': app.config['IMAGE_WIDTHS'],
+    }
+
+
+@app.route("/pet_images/<filename>")
+def pet_image(filename):
+    if not is_hashed_image(filename):
+        abort(404)
+    response = send_from_directory(
+        app.config['UPLOAD_FOLDER'], filename,
+        etag=filename.split('.')[0], max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.cli.command('backfill-images')
+def backfill_images():
+    """기존 pet_*.png 이미지를 해시 이름 + 변형으로 옮긴다."""
+    converted = missing = 0
+    for pet in Pet.query.filter(Pet.image_file != 'default.jpg').all():
+        if is_hashed_image(pet.image_file):
+            continue
+        path = os.path.join(app.config['UPLOAD_FOLDER'], pet.image_file)
+        if not os.path.exists(path):
+            print(f"⚠️ 파일 없음: pet={pet.id} {pet.image_file}")
+            missing += 1
+            continue
+        with open(path, 'rb') as f:
+            pet.image_file = save_pet_image(f.read())
+        db.session.commit()
+        converted += 1
+        gc.collect()
+    print(f"변환 {converted}개, 누락 {missing}개")
+
+
+def fetch_history_page(pet_id, before=None, limit=None):
+    """id < before 인 메시지 중 최신 limit개를 오래된 순으로 돌려준다 (keyset 페이지네이션)."""
+    limit = max(1, limit or app.config['CHAT_PAGE_SIZE'])
+    query = ChatHistory.query.filter(ChatHistory.pet_id == pet_id)
+    if before:
+        query = query.filter(ChatHistory.id < before)
+    rows = query.order_by(ChatHistory.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+
+# ---------------------------------------------------------------------------
+# 입장 제어
+# gthread 4개 중 일부를 한 사용자가 외부 API 호출로 다 잡아버리지 않도록
+#   1) 사용자 x 엔드포인트별 토큰 버킷
+#   2) 외부 API를 부르는 요청의 전역 동시 실행 수 + 사용자별 동시 실행 수
+#   3) 자리가 없으면 짧고 크기가 정해진 대기열에서 순서대로 기다림
+# 을 거치고, 넘치면 120초 타임아웃까지 붙잡지 않고 바로 429 + Retry-After를 돌려준다.
+# 버킷은 기본적으로 프로세스 메모리에 두고 ADMISSION_BACKEND=sqlite면 SQLite에 둔다.
+# ---------------------------------------------------------------------------
+ADMISSION_REJECTED = Counter(
+    'remempet_admission_rejected_total', 'Requests rejected by admission control.', ('endpoint', 'reason'))
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _take_token_memory(key, rate, burst, now):
+    with _buckets_lock:
+        tokens, updated = _buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            _buckets[key] = (tokens - 1, now)
+            return 0
+        _buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+
+def _take_token_sqlite(key, rate, burst, now):
+    # 읽고-쓰기를 UPSERT 한 문장으로 처리해서 여러 worker가 동시에 와도 안전하다.
+    params = {'key': key, 'rate': rate, 'burst': burst, 'now': now}
+    refill = "MIN(:burst, tokens + (:now - updated_at) * :rate)"
+    taken = db.session.execute(db.text(
+        "INSERT INTO rate_bucket (key, tokens, updated_at) VALUES (:key, :burst - 1, :now) "
+        f"ON CONFLICT(key) DO UPDATE SET tokens = {refill} - 1, updated_at = :now "
+        f"WHERE {refill} >= 1"), params).rowcount
+    db.session.commit()
+    if taken:
+        return 0
+    tokens = db.session.execute(db.text(f"SELECT {refill} FROM rate_bucket WHERE key = :key"), params).scalar()
+    return (1 - tokens) / rate
+
+
+def take_token(key, rate, burst):
+    """토큰을 하나 쓴다. 남은 토큰이 없으면 다음 토큰까지 기다릴 초를 돌려준다."""
+    if app.config['ADMISSION_BACKEND'] == 'sqlite':
+        return _take_token_sqlite(key, rate, burst, time.time())
+    return _take_token_memory(key, rate, burst, time.monotonic())
+
+
+class UpstreamGate:
+    """외부 API를 부르는 요청의 동시 실행 수를 제한하는 FIFO 대기열."""
+
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.per_user = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, user_id):
+        """자리를 얻으면 None, 못 얻으면 거절 사유를 돌려준다."""
+        limit = app.config['UPSTREAM_CONCURRENCY']
+        with self._cond:
+            # 대기열에 서 있는 요청도 그 사용자의 몫으로 센다. 그래야 한 사람이 대기열을 다 채우지 못한다.
+            if self.per_user.get(user_id, 0) >= app.config['UPSTREAM_USER_INFLIGHT']:
+                return 'user_inflight'
+            # 기다리는 사람이 있으면 새로 온 요청은 새치기하지 않고 뒤에 선다.
+            if self.active >= limit or self.waiting:
+                if self.waiting >= app.config['ADMISSION_QUEUE_MAX']:
+                    return 'queue_full'
+                self._add_user(user_id, 1)
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < limit,
+                                                   app.config['ADMISSION_QUEUE_TIMEOUT'])
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self._add_user(user_id, -1)
+                    return 'queue_timeout'
+            else:
+                self._add_user(user_id, 1)
+            self.active += 1
+            return None
+
+    def release(self, user_id):
+        with self._cond:
+            self.active -= 1
+            self._add_user(user_id, -1)
+            self._cond.notify()
+
+    def _add_user(self, user_id, delta):
+        count = self.per_user.get(user_id, 0) + delta
+        if count:
+            self.per_user[user_id] = count
+        else:
+            del self.per_user[user_id]
+
+
+upstream_gate = UpstreamGate()
+
+
+def too_many_requests(endpoint, reason, retry_after):
+    ADMISSION_REJECTED.inc(endpoint, reason)
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({
+        'success': False,
+        'error': '요청이 너무 많아요. 잠시 후 다시 시도해주세요.',
+        'retry_after': retry_after,
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission(endpoint):
+    """ADMISSION_LIMITS[endpoint] 설정으로 라우트를 감싼다. login_required 안쪽에 둔다."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limits = app.config['ADMISSION_LIMITS'][endpoint]
+            user_id = current_user.id
+            wait = take_token(f"{endpoint}:{user_id}", limits['rate'], limits['burst'])
+            if wait:
+                return too_many_requests(endpoint, 'rate', wait)
+            if not limits.get('upstream'):
+                return view(*args, **kwargs)
+
+            reason = upstream_gate.acquire(user_id)
+            if reason:
+                return too_many_requests(endpoint, reason, app.config['ADMISSION_QUEUE_TIMEOUT'])
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except Exception:
+                upstream_gate.release(user_id)
+                raise
+            # 스트리밍 응답은 본문을 다 보낸 뒤에 자리를 돌려준다.
+            if response.is_streamed:
+                response.call_on_close(lambda: upstream_gate.release(user_id))
+            else:
+                upstream_gate.release(user_id)
+            return response
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# 지연 이미지 생성 (single-flight)
+# 이미지가 아직 default.jpg인 펫은 채팅 화면에서 처음 열 때 이미지를 만든다.
+# 같은 펫에 대한 요청은 새로고침이든 다른 탭이든 진행 중인 생성 하나에
+# 합류하고, 호출자는 가벼운 pending 응답을 받아 폴링한다.
+# ---------------------------------------------------------------------------
+_image_flights = {}
+_image_flights_lock = threading.Lock()
+
+
+def _pet_image_result(pet):
+    return {
+        'success': True,
+        'status': 'done',
+        'image_file': pet.image_file,
+        'image_url': pet_image_url(pet.image_file, 480),
+        'image_srcset': pet_image_srcset(pet.image_file) if is_hashed_image(pet.image_file) else '',
+    }
+
+
+def _prune_image_flights():
+    # 실패 기록은 폴링하던 쪽이 볼 수 있을 만큼만 남긴다. _image_flights_lock을 잡고 호출한다.
+    expired = time.time() - app.config['IMAGE_FLIGHT_FAILED_TTL']
+    for pet_id in [k for k, f in _image_flights.items() if f['status'] == 'failed' and f['finished'] < expired]:
+        del _image_flights[pet_id]
+
+
+def get_image_flight(pet_id):
+    with _image_flights_lock:
+        _prune_image_flights()
+        return dict(_image_flights.get(pet_id) or {'status': 'idle'})
+
+
+def start_image_flight(pet_id):
+    """진행 중인 생성이 있으면 합류하고, 없으면 새로 시작한다. 자리가 없으면 False."""
+    with _image_flights_lock:
+        _prune_image_flights()
+        flight = _image_flights.get(pet_id)
+        if flight and flight['status'] == 'pending':
+            return True
+        if sum(f['status'] == 'pending' for f in _image_flights.values()) >= app.config['IMAGE_FLIGHTS_MAX']:
+            return False
+        _image_flights[pet_id] = {'status': 'pending', 'started': time.time()}
+    threading.Thread(target=_run_image_flight, args=(pet_id,), name=f'pet-image-{pet_id}', daemon=True).start()
+    return True
+
+
+def _run_image_flight(pet_id):
+    with app.app_context():
+        try:
+            pet = db.session.get(Pet, pet_id)
+            t_breed, t_color, t_food, t_bg = translate_many([pet.breed, pet.color, pet.favorite_food, pet.background])
+            t = {'breed': t_breed, 'color': t_color, 'food': t_food, 'background': t_bg}
+            image_bytes = generate_image_stability_v2(build_image_prompt(t, pet.age))
+            if not image_bytes:
+                raise Exception("이미지 데이터를 받아오지 못했습니다.")
+            filename = save_pet_image(image_bytes)
+
+            # 그 사이 다른 경로로 이미지가 생겼다면 덮어쓰지 않는다.
+            Pet.query.filter_by(id=pet_id, image_file='default.jpg').update(
+                {'image_file': filename}, synchronize_session=False)
+            db.session.commit()
+            with _image_flights_lock:
+                _image_flights.pop(pet_id, None)
+        except Exception as e:
+            print(f"이미지 생성 오류: {e}")
+            db.session.rollback()
+            # 실패는 IMAGE_FLIGHT_FAILED_TTL 동안 남겨서 폴링하던 쪽이 알 수 있게 하고, 다음 POST가 다시 시작한다.
+            with _image_flights_lock:
+                _image_flights[pet_id] = {'status': 'failed', 'error': str(e), 'finished': time.time()}
+        finally:
+            db.session.remove()
+            gc.collect()
+
+
+# ---------------------------------------------------------------------------
+# 대화 내보내기 / 가져오기 (NDJSON)
+# 한 줄에 JSON 하나씩:
+#   {"type": "pet", "version": 1, "name": ..., "persona_prompt": ..., "history_summary": ..., "summary_covers": N}
+#   {"type": "image", "data": "<base64 원본 이미지>"}       (이미지가 있을 때만)
+#   {"type": "message", "role": "user" | "model", "content": ...}
+# 내보내기는 yield_per로 서버 쪽 커서를 돌면서 흘려보내고, 가져오기는 요청 본문을
+# 줄 단위로 읽어 배치 INSERT 하므로 대화가 아무리 길어도 메모리는 일정하다.
+# summary_covers는 요약에 이미 접힌 앞쪽 메시지 수다 (id는 옮기면 바뀌므로).
+# ---------------------------------------------------------------------------
+PET_EXPORT_FIELDS = ('name', 'breed', 'color', 'age', 'favorite_food', 'background',
+                     'persona_prompt', 'history_summary')
+
+
+def _ndjson(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_pet_lines(pet_id):
+    pet = db.session.get(Pet, pet_id)
+    covers = 0
+    if pet.summary_upto:
+        covers = ChatHistory.query.filter(ChatHistory.pet_id == pet_id,
+                                          ChatHistory.id <= pet.summary_upto).count()
+    record = {'type': 'pet', 'version': 1, 'summary_covers': covers}
+    record.update({field: getattr(pet, field) for field in PET_EXPORT_FIELDS})
+    yield _ndjson(record)
+
+    path = os.path.join(app.config['UPLOAD_FOLDER'], pet.image_file)
+    if pet.image_file != 'default.jpg' and os.path.exists(path):
+        with open(path, 'rb') as f:
+            yield _ndjson({'type': 'image', 'data': base64.b64encode(f.read()).decode('ascii')})
+
+    rows = db.session.execute(
+        db.select(ChatHistory.role, ChatHistory.content)
+        .where(ChatHistory.pet_id == pet_id)
+        .order_by(ChatHistory.id)
+        .execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    # 한 줄씩 쓰면 write가 너무 잘게 나가므로 64KB 정도씩 모아서 보낸다.
+    buffer, size = [], 0
+    for role, content in rows:
+        line = _ndjson({'type': 'message', 'role': role, 'content': content})
+        buffer.append(line)
+        size += len(line)
+        if size >= 64 * 1024:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def read_limited_lines(stream, limit):
+    """stream을 줄 단위로 읽되, limit 바이트를 넘는 줄은 끝까지 읽지 않고 거절한다."""
+    while True:
+        line = stream.readline(limit + 1)
+        if not line:
+            return
+        if len(line) > limit:
+            raise ValueError(f"한 줄이 너무 깁니다 (최대 {limit} 바이트).")
+        yield line
+
+
+def _read_import(lines, spool, image_spool):
+    """NDJSON을 끝까지 검사하면서 메시지는 spool에, 이미지는 image_spool에 옮겨 적는다.
+
+    DB와 UPLOAD_FOLDER는 건드리지 않는다. (pet 정보, 이미지 유무, 메시지 수)를 돌려준다.
+    """
+    pet_record = None
+    has_image = False
+    count = 0
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"{number}번째 줄이 JSON이 아닙니다.")
+        if not isinstance(record, dict):
+            raise ValueError(f"{number}번째 줄이 JSON 객체가 아닙니다.")
+        kind = record.get('type')
+
+        if pet_record is None:
+            if kind != 'pet' or not isinstance(record.get('name'), str) or not record['name'].strip():
+                raise ValueError("첫 줄은 이름이 있는 pet 정보여야 합니다.")
+            for field in PET_EXPORT_FIELDS:
+                value = record.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    record[field] = str(value)
+                elif not isinstance(value, (str, type(None))):
+                    raise ValueError(f"pet 정보의 '{field}' 값이 올바르지 않습니다.")
+            covers = record.get('summary_covers') or 0
+            if not isinstance(covers, int) or isinstance(covers, bool) or covers < 0:
+                raise ValueError("pet 정보의 'summary_covers' 값이 올바르지 않습니다.")
+            record['summary_covers'] = covers
+            pet_record = record
+        elif kind == 'image':
+            image_spool.seek(0)
+            image_spool.truncate()
+            image_spool.write(_decode_import_image(record.get('data')))
+            has_image = True
+        elif kind == 'message':
+            if record.get('role') not in ('user', 'model') or not isinstance(record.get('content'), str):
+                raise ValueError(f"{number}번째 줄의 메시지 형식이 올바르지 않습니다.")
+            spool.write(json.dumps([record['role'], record['content']], ensure_ascii=False) + "\n")
+            count += 1
+        else:
+            raise ValueError(f"{number}번째 줄: 알 수 없는 type '{kind}'")
+
+    if pet_record is None:
+        raise ValueError("가져올 내용이 없습니다.")
+    return pet_record, has_image, count
+
+
+def _decode_import_image(data):
+    """base64 이미지를 풀고 PIL로 읽을 수 있는지만 확인한다. 저장은 검사가 다 끝난 뒤에 한다."""
+    from PIL import Image
+    try:
+        if not isinstance(data, str):
+            raise ValueError
+        image_bytes = base64.b64decode(data, validate=True)
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.verify()
+        return image_bytes
+    except (ValueError, OSError, SyntaxError, Image.DecompressionBombError):
+        # base64가 아니거나(binascii.Error) PIL이 읽지 못하는(UnidentifiedImageError) 경우
+        raise ValueError("이미지 데이터를 읽을 수 없습니다.")
+
+
+def import_pet_lines(lines, user_id):
+    """NDJSON 줄들로 새 펫을 만든다. (pet, 메시지 수)를 돌려주고, 커밋은 호출한 쪽에서 한다.
+
+    업로드를 읽고 이미지를 인코딩하는 동안 SQLite 쓰기 잠금을 잡고 있지 않도록,
+    먼저 전부 검사해 임시 파일에 옮겨 두고 DB에는 마지막에 한 번에 넣는다.
+    """
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as spool, tempfile.TemporaryFile('w+b') as image_spool:
+        record, has_image, count = _read_import(lines, spool, image_spool)
+        covers = record['summary_covers']
+        image_file = 'default.jpg'
+        if has_image:
+            image_spool.seek(0)
+            try:
+                image_file = save_pet_image(image_spool.read())
+            except OSError:
+                raise ValueError("이미지 데이터를 읽을 수 없습니다.")
+        spool.seek(0)
+
+        fields = {field: record.get(field) for field in PET_EXPORT_FIELDS}
+        if not fields['persona_prompt']:
+            fields['persona_prompt'] = build_persona_prompt(
+                fields['name'], fields['breed'], fields['color'], fields['age'], fields['favorite_food'])
+        pet = Pet(user_id=user_id, image_file=image_file, **fields)
+        db.session.add(pet)
+        db.session.flush()
+
+        batch_size = app.config['IMPORT_BATCH_SIZE']
+        batch = []
+        for line in spool:
+            role, content = json.loads(line)
+            batch.append({'role': role, 'content': content, 'pet_id': pet.id})
+            if len(batch) >= batch_size:
+                db.session.execute(db.insert(ChatHistory), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(ChatHistory), batch)
+
+    if covers > 0 and count and pet.history_summary:
+        last_summarized = (ChatHistory.query.filter_by(pet_id=pet.id)
+                           .order_by(ChatHistory.id.asc())
+                           .offset(min(covers, count) - 1).first())
+        pet.summary_upto = last_summarized.id if last_summarized else 0
+    return pet, count
 
 
 @app.route("/")
@@ -132,8 +1750,25 @@ def chat_page(pet_id):
     if pet.owner != current_user:
         flash('권한이 없습니다.', 'danger')
         return redirect(url_for('home'))
-    history_db = ChatHistory.query.filter_by(pet_id=pet.id).order_by(ChatHistory.id.asc()).all()
-    return render_template('chat.html', pet=pet, history=history_db)
+    history_db, has_more = fetch_history_page(pet.id)
+    return render_template('chat.html', pet=pet, history=history_db, has_more=has_more)
+
+
+@app.route("/api/history/<int:pet_id>")
+@login_required
+def api_history(pet_id):
+    pet = Pet.query.get_or_404(pet_id)
+    if pet.owner != current_user:
+        return jsonify({'error': '권한 없음'}), 403
+
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', app.config['CHAT_PAGE_SIZE'], type=int), 100)
+    rows, has_more = fetch_history_page(pet.id, before, limit)
+    return jsonify({
+        'messages': [{'id': h.id, 'role': h.role, 'content': h.content} for h in rows],
+        'has_more': has_more,
+        'next_before': rows[0].id if rows else None,
+    })
 
 
 @app.route("/register", methods=['GET', 'POST'])
@@ -173,72 +1808,84 @@ def logout():
 
 @app.route("/api/create_pet", methods=['POST'])
 @login_required
+@admission('create_pet')
 def api_create_pet():
-    try:
-        data = request.json
-        name = data.get('name')
-        breed = data.get('breed')
-        color = data.get('color')
-        age = data.get('age')
-        food = data.get('favorite_food')
-        bg = data.get('background')
-
-        if not name or not breed or not color or not age:
-            return jsonify({'success': False, 'error': '필수 항목 누락'}), 400
-
-        t_breed, t_color, t_food, t_bg = translate(breed), translate(color), translate(food), translate(bg)
-        
-        prompt = (
-            f"A highly detailed 3D render of a cute {t_color} {t_breed} dog, {age} years old. "
-            f"The dog is eating {t_food} in a {t_bg} setting. "
-            "Pixar style, Disney animation style, octane render, 8k, soft lighting, happy expression."
-        )
+    data = request.json or {}
+    name = data.get('name')
+    breed = data.get('breed')
+    color = data.get('color')
+    age = data.get('age')
 
-        image_bytes = generate_image_stability_v2(prompt)
-        
-        if not image_bytes:
-            raise Exception("이미지 데이터를 받아오지 못했습니다.")
+    if not name or not breed or not color or not age:
+        return jsonify({'success': False, 'error': '필수 항목 누락'}), 400
 
-        image = Image.open(io.BytesIO(image_bytes))
-        filename = f"pet_{current_user.id}_{int(time.time())}.png"
-        image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        image.close()
+    payload = {k: data.get(k) for k in ('name', 'breed', 'color', 'age', 'favorite_food', 'background')}
+    job = PetJob(user_id=current_user.id, payload=json.dumps(payload, ensure_ascii=False))
+    db.session.add(job)
+    db.session.commit()
 
-        persona_prompt = f"""당신은 하늘나라에 있는 반려견 '{name}'입니다. 종:{breed}, 색:{color}, 나이:{age}, 좋아하는 음식:{food}. 주인과 다시 만나서 너무 기쁘고, 보고 싶었던 마음을 표현합니다. 반말로 다정하고 그리워하는 톤으로 대화해주세요. '하늘나라', '무지개다리', '별나라' 같은 표현을 자연스럽게 사용하세요."""
-        
-        new_pet = Pet(
-            name=name, breed=breed, color=color, age=age, 
-            favorite_food=food, background=bg, image_file=filename, 
-            persona_prompt=persona_prompt, user_id=current_user.id
-        )
-        db.session.add(new_pet)
-        db.session.commit()
-        
-        model = genai.GenerativeModel(CHAT_MODEL_NAME)
-        chat = model.start_chat(history=[
-            {"role": "user", "parts": [persona_prompt]}, 
-            {"role": "model", "parts": [f"안녕! 나 {name}야!"]}
-        ])
-        first_msg = chat.send_message(f"'{name}'으로서, 하늘나라에서 오랜만에 주인을 만난 기쁨을 반말로 따뜻하게 표현해줘. 보고 싶었다는 마음을 담아서.").text
-        
-        db.session.add(ChatHistory(role='model', content=first_msg, pet_id=new_pet.id))
+    if not submit_pet_job(job.id, job.worker_pid):
+        db.session.delete(job)
         db.session.commit()
+        return too_many_requests('create_pet', 'job_queue_full', 30)
 
-        return jsonify({
-            'success': True, 
-            'pet_id': new_pet.id, 
-            'first_message': first_msg,
-            'pet_name': new_pet.name
-        })
-    
-    except Exception as e:
-        print(f"생성 오류: {e}")
-        gc.collect()
-        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+
+@app.route("/api/generate_image/<int:pet_id>", methods=['POST'])
+@login_required
+@admission('generate_image')
+def api_generate_image(pet_id):
+    pet = Pet.query.get_or_404(pet_id)
+    if pet.owner != current_user:
+        return jsonify({'success': False, 'error': '권한 없음'}), 403
+    if pet.image_file != 'default.jpg':
+        return jsonify(_pet_image_result(pet))
+
+    if not start_image_flight(pet.id):
+        return too_many_requests('generate_image', 'flights_full', 30)
+    return jsonify({'success': False, 'status': 'pending'}), 202
+
+
+@app.route("/api/generate_image/<int:pet_id>", methods=['GET'])
+@login_required
+def api_generate_image_status(pet_id):
+    pet = Pet.query.get_or_404(pet_id)
+    if pet.owner != current_user:
+        return jsonify({'success': False, 'error': '권한 없음'}), 403
+    if pet.image_file != 'default.jpg':
+        return jsonify(_pet_image_result(pet))
+
+    flight = get_image_flight(pet.id)
+    if flight['status'] == 'failed':
+        return jsonify({'success': False, 'status': 'failed', 'error': flight['error']})
+    return jsonify({'success': False, 'status': flight['status']}), 202 if flight['status'] == 'pending' else 200
+
+
+@app.route("/api/pet_jobs/<job_id>")
+@login_required
+def api_pet_job(job_id):
+    job = db.session.get(PetJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({'success': False, 'error': '작업을 찾을 수 없습니다.'}), 404
+
+    # 작업을 돌리던 worker가 재시작으로 사라졌다면 여기서 이어받는다.
+    if job.status not in PET_JOB_FINISHED and not _pid_alive(job.worker_pid):
+        submit_pet_job(job.id, job.worker_pid)
+
+    result = {'success': job.status != 'failed', 'job_id': job.id, 'status': job.status}
+    if job.status == 'done':
+        result.update(pet_id=job.pet_id, first_message=job.first_message,
+                      pet_name=json.loads(job.payload)['name'],
+                      thumb_url=pet_image_url(job.image_file, app.config['IMAGE_WIDTHS'][0]))
+    elif job.status == 'failed':
+        result.update(error=job.error, pet_id=job.pet_id)
+    return jsonify(result)
 
 
 @app.route("/api/chat/<int:pet_id>", methods=['POST'])
 @login_required
+@admission('chat')
 def api_chat(pet_id):
     pet = Pet.query.get_or_404(pet_id)
     if pet.owner != current_user:
@@ -248,37 +1895,75 @@ def api_chat(pet_id):
     if not msg:
         return jsonify({'reply': "..."})
 
-    history_db = ChatHistory.query.filter_by(pet_id=pet.id).order_by(ChatHistory.id.asc()).all()
-    
-    gemini_history = [
-        {"role": "user", "parts": [pet.persona_prompt]}, 
-        {"role": "model", "parts": ["알겠어!"]}
-    ]
-    
-    for h in history_db:
-        gemini_history.append({"role": h.role, "parts": [h.content]})
+    gemini_history = build_chat_context(pet, msg)
+
+    # Accept: text/event-stream 이면 답장을 토큰 단위로 흘려보낸다.
+    if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+        return Response(
+            stream_with_context(stream_chat_reply(pet.id, msg, gemini_history)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
 
     try:
-        model = genai.GenerativeModel(CHAT_MODEL_NAME)
-        chat = model.start_chat(history=gemini_history)
-        reply = chat.send_message(msg).text
+        reply = gemini_call(lambda: get_chat_model().start_chat(history=gemini_history).send_message(
+            msg, request_options=gemini_options())).text
         
         db.session.add(ChatHistory(role='user', content=msg, pet_id=pet.id))
         db.session.add(ChatHistory(role='model', content=reply, pet_id=pet.id))
         db.session.commit()
+        schedule_history_fold(pet.id)
         
-        del chat
-        del model
         gc.collect()
         
         return jsonify({'reply': reply})
         
+    except CircuitOpenError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"채팅 오류: {e}")
         gc.collect()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route("/api/export/<int:pet_id>")
+@login_required
+def api_export(pet_id):
+    pet = Pet.query.get_or_404(pet_id)
+    if pet.owner != current_user:
+        return jsonify({'error': '권한 없음'}), 403
+    return Response(
+        stream_with_context(export_pet_lines(pet.id)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="pet_{pet.id}.ndjson"'}
+    )
+
+
+@app.route("/api/import", methods=['POST'])
+@login_required
+@admission('import_pet')
+def api_import():
+    request.max_content_length = app.config['IMPORT_MAX_BYTES']
+    try:
+        lines = read_limited_lines(request.stream, app.config['IMPORT_MAX_LINE_BYTES'])
+        pet, count = import_pet_lines(lines, current_user.id)
+        db.session.commit()
+        return jsonify({'success': True, 'pet_id': pet.id, 'pet_name': pet.name, 'messages': count})
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        limit_mb = app.config['IMPORT_MAX_BYTES'] // (1024 * 1024)
+        return jsonify({'success': False, 'error': f"파일이 너무 큽니다 (최대 {limit_mb}MB)."}), 413
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e) or '파일 형식이 올바르지 않습니다.'}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"가져오기 오류: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        gc.collect()
+
+
 @app.route("/api/delete_pet/<int:pet_id>", methods=['POST'])
 @login_required
 def api_delete_pet(pet_id):
@@ -298,7 +1983,10 @@ def api_delete_pet(pet_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+init_db()
+
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+    resume_pet_jobs()
+    start_warm_up()
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 10000)))
@@ -0,0 +1,13 @@
+"""가짜 외부 API를 끼운 app.py. gunicorn이 이 모듈을 불러서 실제 설정 그대로 띄운다.
+
+    gunicorn -c gunicorn_config.py --pythonpath bench bench_app:app
+
+STABILITY_API_URL은 loadtest.py가 띄운 가짜 Stability 서버를 가리켜야 한다.
+"""
+import app as remempet
+from fakes import FakeGenerativeModel, fake_translate
+
+remempet.set_chat_model(FakeGenerativeModel(remempet.CHAT_MODEL_NAME))
+remempet.set_translate_backend(fake_translate)
+
+app = remempet.app
@@ -0,0 +1,128 @@
+"""벤치마크용 가짜 Gemini / Stability / 번역기.
+
+API 크레딧 없이 부하 테스트를 돌리기 위해 지연 시간과 오류율을
+환경 변수로 조절할 수 있는 대역을 제공한다.
+
+    BENCH_GEMINI_LATENCY      Gemini 응답 시간(초)          기본 1.0
+    BENCH_GEMINI_ERROR_RATE   Gemini 503 비율 (0~1)         기본 0
+    BENCH_STABILITY_LATENCY   Stability 응답 시간(초)       기본 5.0
+    BENCH_STABILITY_ERROR_RATE Stability 503 비율           기본 0
+    BENCH_TRANSLATE_LATENCY   번역 응답 시간(초)            기본 0.3
+    BENCH_TRANSLATE_ERROR_RATE 번역 실패 비율               기본 0
+"""
+import io
+import os
+import random
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
+
+
+def _setting(name, default):
+    return float(os.getenv(name, default))
+
+
+def _sleep(latency):
+    # 실제 API처럼 ±20% 흔들리게 한다.
+    if latency > 0:
+        time.sleep(latency * random.uniform(0.8, 1.2))
+
+
+def _fail(rate):
+    return rate > 0 and random.random() < rate
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+REPLY = "나도 보고 싶었어! 하늘나라에서 매일 너를 생각했어. 무지개다리 건너에서 기다리고 있을게."
+
+
+class FakeChatSession:
+    def __init__(self, history=None):
+        self.history = history or []
+
+    def send_message(self, content, stream=False, **kwargs):
+        latency = _setting('BENCH_GEMINI_LATENCY', 1.0)
+        if _fail(_setting('BENCH_GEMINI_ERROR_RATE', 0)):
+            _sleep(latency * 0.1)
+            raise google_exceptions.ServiceUnavailable("fake gemini unavailable")
+        if not stream:
+            _sleep(latency)
+            return types.SimpleNamespace(text=REPLY)
+
+        # 실제 SDK처럼 첫 조각은 send_message 안에서 받고 나머지는 순회하며 받는다.
+        words = REPLY.split(" ")
+        _sleep(latency * 0.3)
+
+        def chunks():
+            yield types.SimpleNamespace(text=words[0])
+            for word in words[1:]:
+                _sleep(latency * 0.7 / len(words))
+                yield types.SimpleNamespace(text=" " + word)
+        return chunks()
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def start_chat(self, history=None):
+        return FakeChatSession(history)
+
+    def generate_content(self, contents, **kwargs):
+        return FakeChatSession().send_message(contents)
+
+
+# ---------------------------------------------------------------------------
+# 번역기
+# ---------------------------------------------------------------------------
+def fake_translate(text):
+    _sleep(_setting('BENCH_TRANSLATE_LATENCY', 0.3))
+    if _fail(_setting('BENCH_TRANSLATE_ERROR_RATE', 0)):
+        raise RuntimeError("fake translator error")
+    return f"en:{text}"
+
+
+# ---------------------------------------------------------------------------
+# Stability: 실제 HTTP 서버로 띄워서 세션/커넥션 풀 경로까지 그대로 탄다.
+# ---------------------------------------------------------------------------
+def _fake_png():
+    buffer = io.BytesIO()
+    color = tuple(random.randrange(256) for _ in range(3))
+    Image.new('RGB', (1024, 1024), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class _StabilityHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        latency = _setting('BENCH_STABILITY_LATENCY', 5.0)
+        if _fail(_setting('BENCH_STABILITY_ERROR_RATE', 0)):
+            _sleep(latency * 0.1)
+            body, status, content_type = b'{"errors":["fake overload"]}', 503, 'application/json'
+        else:
+            _sleep(latency)
+            body, status, content_type = _fake_png(), 200, 'image/png'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stability_server(port=0):
+    """가짜 Stability 서버를 백그라운드 스레드로 띄우고 (server, url)을 돌려준다."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), _StabilityHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v2beta/stable-image/generate/core"
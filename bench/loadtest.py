@@ -0,0 +1,308 @@
+"""오프라인 부하 테스트.
+
+가짜 Stability 서버를 띄우고, 가짜 Gemini/번역기를 끼운 app.py를
+gunicorn_config.py 설정 그대로 gunicorn으로 실행한 뒤 가상 사용자들이
+실제와 비슷한 비율로 요청을 보낸다. 끝나면 동작별 p50/p95/p99와 처리량을
+출력한다.
+
+    python bench/loadtest.py --users 8 --duration 60
+    python bench/loadtest.py --threads 8 --json after.json --baseline before.json
+
+--url을 주면 서버를 띄우지 않고 이미 떠 있는 서버를 친다 (가짜 API 설정은 그쪽 몫).
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+DEFAULT_MIX = "home=30,chat_page=15,api_chat=25,api_chat_stream=10,history=10,login=5,create_pet=5"
+CREATE_FORM = [
+    {'name': '초코', 'breed': '말티즈', 'color': '흰색', 'age': '12', 'favorite_food': '닭가슴살', 'background': '공원'},
+    {'name': '보리', 'breed': '푸들', 'color': '갈색', 'age': '9', 'favorite_food': '고구마', 'background': '바다'},
+    {'name': '콩이', 'breed': '시바견', 'color': '황색', 'age': '14', 'favorite_food': '사과', 'background': '산'},
+]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = {}
+        self._lock = threading.Lock()
+
+    def record(self, action, seconds, status):
+        with self._lock:
+            if status in (429, 503):
+                self.rejected[action] = self.rejected.get(action, 0) + 1
+            elif status >= 400:
+                self.errors[action] = self.errors.get(action, 0) + 1
+            else:
+                self.latencies.setdefault(action, []).append(seconds)
+
+    def summary(self, elapsed):
+        result = {'elapsed': elapsed, 'actions': {}}
+        total = 0
+        for action in sorted(set(self.latencies) | set(self.errors) | set(self.rejected)):
+            values = sorted(self.latencies.get(action, []))
+            total += len(values)
+            result['actions'][action] = {
+                'count': len(values),
+                'errors': self.errors.get(action, 0),
+                'rejected': self.rejected.get(action, 0),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+        result['rps'] = total / elapsed if elapsed else 0
+        return result
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    # nearest-rank: 정렬된 값 중 ceil(p/100 * n)번째
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class VirtualUser:
+    """로그인한 사용자 한 명. 펫 하나를 만든 뒤 mix 비율대로 요청을 보낸다."""
+
+    def __init__(self, base_url, stats):
+        self.base = base_url
+        self.stats = stats
+        self.session = requests.Session()
+        self.username = f"bench_{uuid.uuid4().hex[:10]}"
+        self.pet_id = None
+
+    def timed(self, action, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base + path, timeout=180, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 599
+        self.stats.record(action, time.perf_counter() - started, status)
+        return response
+
+    def register(self):
+        self.timed('register', 'POST', '/register',
+                   data={'username': self.username, 'password': 'bench'}, allow_redirects=False)
+
+    def login(self):
+        self.session.get(self.base + '/logout', allow_redirects=False, timeout=30)
+        self.timed('login', 'POST', '/login',
+                   data={'username': self.username, 'password': 'bench'}, allow_redirects=False)
+
+    def create_pet(self):
+        started = time.perf_counter()
+        response = self.timed('create_pet', 'POST', '/api/create_pet', json=random.choice(CREATE_FORM))
+        if response is None or response.status_code != 202:
+            return
+        job_id = response.json()['job_id']
+        while True:
+            time.sleep(1)
+            poll = self.timed('pet_job_poll', 'GET', f'/api/pet_jobs/{job_id}')
+            if poll is None or poll.status_code != 200:
+                return
+            data = poll.json()
+            if data['status'] in ('done', 'failed'):
+                # 제출부터 완료까지 사용자가 기다린 전체 시간
+                self.stats.record('create_pet_job', time.perf_counter() - started,
+                                  200 if data['status'] == 'done' else 500)
+                if data['status'] == 'done':
+                    self.pet_id = data['pet_id']
+                return
+
+    def home(self):
+        self.timed('home', 'GET', '/home')
+
+    def chat_page(self):
+        self.timed('chat_page', 'GET', f'/chat/{self.pet_id}')
+
+    def history(self):
+        self.timed('history', 'GET', f'/api/history/{self.pet_id}?before=1000000000')
+
+    def api_chat(self):
+        self.timed('api_chat', 'POST', f'/api/chat/{self.pet_id}', json={'message': '보고 싶었어'})
+
+    def api_chat_stream(self):
+        started = time.perf_counter()
+        try:
+            with self.session.post(f'{self.base}/api/chat/{self.pet_id}', json={'message': '오늘 뭐 했어?'},
+                                   headers={'Accept': 'text/event-stream'}, stream=True, timeout=180) as response:
+                first = None
+                for chunk in response.iter_content(chunk_size=None):
+                    if first is None and chunk:
+                        first = time.perf_counter()
+                        self.stats.record('api_chat_stream_ttft', first - started, response.status_code)
+                status = response.status_code
+        except requests.RequestException:
+            status = 599
+        self.stats.record('api_chat_stream', time.perf_counter() - started, status)
+
+    def run(self, mix, deadline):
+        self.register()
+        while self.pet_id is None and time.time() < deadline:
+            self.create_pet()
+        actions, weights = zip(*mix.items())
+        while time.time() < deadline:
+            getattr(self, random.choices(actions, weights)[0])()
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if not hasattr(VirtualUser, name.strip()):
+            raise SystemExit(f"unknown action in --mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def start_server(args, workdir):
+    from fakes import start_stability_server
+
+    stability, stability_url = start_stability_server()
+    env = dict(os.environ,
+               PORT=str(args.port),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               UPLOAD_FOLDER=os.path.join(workdir, 'pet_images'),
+               STABILITY_API_URL=stability_url,
+               GOOGLE_API_KEY='bench', STABILITY_API_KEY='bench', SECRET_KEY='bench',
+               BENCH_GEMINI_LATENCY=str(args.gemini_latency),
+               BENCH_GEMINI_ERROR_RATE=str(args.gemini_error_rate),
+               BENCH_STABILITY_LATENCY=str(args.stability_latency),
+               BENCH_STABILITY_ERROR_RATE=str(args.stability_error_rate),
+               BENCH_TRANSLATE_LATENCY=str(args.translate_latency),
+               BENCH_TRANSLATE_ERROR_RATE=str(args.translate_error_rate))
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py',
+               '--pythonpath', 'bench', 'bench_app:app']
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    command += args.gunicorn_arg
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    for _ in range(200):
+        if process.poll() is not None:
+            raise SystemExit(f"gunicorn exited early, see {log.name}")
+        try:
+            if requests.get(base_url + '/login', timeout=1).status_code == 200:
+                return process, stability, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise SystemExit(f"gunicorn did not become ready, see {log.name}")
+
+
+def print_report(result, label):
+    print(f"\n== {label} ==  {result['elapsed']:.1f}s, {result['rps']:.1f} req/s")
+    print(f"{'action':<22}{'count':>7}{'err':>6}{'rej':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, row in result['actions'].items():
+        print(f"{action:<22}{row['count']:>7}{row['errors']:>6}{row['rejected']:>6}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+
+def compare(result, baseline, tolerance):
+    """baseline보다 p95가 tolerance 이상 느려졌거나 처리량이 줄어든 항목을 돌려준다."""
+    regressions = []
+    for action, row in result['actions'].items():
+        before = baseline['actions'].get(action)
+        if before and before['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{action}: p95 {before['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms")
+    if result['rps'] < baseline['rps'] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['rps']:.1f} -> {result['rps']:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='benchmark an already running server instead of starting gunicorn')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--workers', type=int, help='override gunicorn_config.py workers')
+    parser.add_argument('--threads', type=int, help='override gunicorn_config.py threads')
+    parser.add_argument('--gunicorn-arg', action='append', default=[], help='extra gunicorn argument (repeatable)')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'action weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--gemini-latency', type=float, default=1.0)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--stability-latency', type=float, default=5.0)
+    parser.add_argument('--stability-error-rate', type=float, default=0.0)
+    parser.add_argument('--translate-latency', type=float, default=0.3)
+    parser.add_argument('--translate-error-rate', type=float, default=0.0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temp dir (db, images, gunicorn.log)')
+    parser.add_argument('--baseline', help='compare with a previous --json result; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='remempet-bench-')
+    process = stability = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            process, stability, base_url = start_server(args, workdir)
+
+        stats = Stats()
+        started = time.time()
+        deadline = started + args.duration
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            for future in [pool.submit(VirtualUser(base_url, stats).run, mix, deadline) for _ in range(args.users)]:
+                future.result()
+        result = stats.summary(time.time() - started)
+        result['config'] = {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')}
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if stability is not None:
+            stability.shutdown()
+
+    label = f"workers={args.workers or 'config'} threads={args.threads or 'config'} users={args.users}"
+    print_report(result, label)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("\n⚠️ regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nno regressions vs baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""콜드 스타트 벤치마크.
+
+1) `python -X importtime`으로 app.py import 시간을 모듈별로 나눠 보여준다.
+   app import 때 바로 불리는 모듈(eager)과, warm_up()이 처음 쓸 때
+   불러오는 SDK(lazy)를 따로 출력한다.
+2) gunicorn_config.py 그대로 gunicorn을 띄워 프로세스 시작부터
+   /login 첫 응답(첫 바이트)까지 걸린 시간을 잰다.
+
+    python bench/startup.py
+    python bench/startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import app
+app.warm_up()
+"""
+
+
+def parse_importtime(stderr):
+    """-X importtime 출력을 (깊이, 이름, 누적 us) 목록으로 바꾼다."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 이름 앞 공백: 구분용 1칸 + 깊이마다 2칸
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative)))
+    return entries
+
+
+def import_profile(workdir, top):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+               UPLOAD_FOLDER=os.path.join(workdir, 'pet_images'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(result.stderr[-2000:])
+    entries = parse_importtime(result.stderr)
+
+    # importtime은 자식을 부모보다 먼저 출력한다. 'app' 바로 앞의 깊이 1 항목들이 app이 직접 부른 모듈이고,
+    # 'app' 뒤의 최상위 항목들은 warm_up()이 지연 import한 모듈이다.
+    app_index = next(i for i, (depth, name, _) in enumerate(entries) if depth == 0 and name == 'app')
+    start = max((i for i, (depth, _, _) in enumerate(entries[:app_index]) if depth == 0), default=-1) + 1
+    eager = [(name, us) for depth, name, us in entries[start:app_index] if depth == 1]
+    lazy = [(name, us) for depth, name, us in entries[app_index + 1:] if depth == 0]
+    return {
+        'app_import_ms': entries[app_index][2] / 1000,
+        'eager': sorted(((n, us / 1000) for n, us in eager), key=lambda x: -x[1])[:top],
+        'lazy_ms': sum(us for _, us in lazy) / 1000,
+        'lazy': sorted(((n, us / 1000) for n, us in lazy), key=lambda x: -x[1])[:top],
+    }
+
+
+def time_to_first_byte(workdir, port, warmup):
+    env = dict(os.environ, PORT=str(port), WARMUP_ON_BOOT='1' if warmup else '0',
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+               UPLOAD_FOLDER=os.path.join(workdir, 'pet_images'))
+    url = f"http://127.0.0.1:{port}/login"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'app:app'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < 60:
+            if process.poll() is not None:
+                raise SystemExit("gunicorn exited early")
+            try:
+                if requests.get(url, timeout=1).status_code == 200:
+                    return (time.perf_counter() - started) * 1000
+            except requests.RequestException:
+                time.sleep(0.01)
+        raise SystemExit("gunicorn did not answer /login within 60s")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='gunicorn cold starts to time')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--top', type=int, default=10, help='modules to list per section')
+    parser.add_argument('--no-warmup', action='store_true', help='start workers with WARMUP_ON_BOOT=0')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='remempet-startup-') as workdir:
+        profile = import_profile(workdir, args.top)
+        ttfb = [time_to_first_byte(workdir, args.port, not args.no_warmup) for _ in range(args.runs)]
+
+    print(f"app import: {profile['app_import_ms']:.0f} ms")
+    for name, ms in profile['eager']:
+        print(f"  {name:<40}{ms:>8.1f} ms")
+    print(f"lazy SDKs (loaded on first use / warm-up): {profile['lazy_ms']:.0f} ms")
+    for name, ms in profile['lazy']:
+        print(f"  {name:<40}{ms:>8.1f} ms")
+    print(f"gunicorn start -> first /login byte: median {statistics.median(ttfb):.0f} ms "
+          f"(runs: {', '.join(f'{t:.0f}' for t in ttfb)})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(profile, ttfb_ms=ttfb), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,3 +30,29 @@ preload_app = True
 
 # Worker 재시작 정책
 worker_tmp_dir = "/dev/shm"  # RAM 디스크 사용 (Render 지원)
+
+
+def post_worker_init(worker):
+    # 이전 worker가 처리하다 만 펫 생성 작업을 이어받고, 무거운 SDK는 백그라운드에서 미리 불러 둔다.
+    from app import resume_pet_jobs, start_warm_up
+    resume_pet_jobs()
+    start_warm_up()
+
+
+def pre_request(worker, req):
+    worker.log.debug("%s %s", req.method, req.path)
+    # 이 worker에서 펫 생성 작업이 도는 중이면 max_requests 재시작을 미룬다. 지금 재시작하면
+    # 진행 중인 Stability 호출이 버려지고 다음 worker가 다시 보내야 한다 (작업 폴링도 요청 수에 들어간다).
+    # 메모리 관리를 위한 재시작이므로 한 worker에서 max_requests번까지만 미룬다.
+    if worker.nr + 1 >= worker.max_requests:
+        from app import pet_jobs_running
+        deferred = getattr(worker, 'pet_job_deferred', 0)
+        if pet_jobs_running() and deferred < worker.max_requests:
+            worker.nr -= 1
+            worker.pet_job_deferred = deferred + 1
+
+
+def worker_exit(server, worker):
+    # 기다리지 않는다. 끊긴 단계는 저장된 중간 결과부터 다음 worker가 이어받는다.
+    from app import stop_pet_jobs
+    stop_pet_jobs(worker.pid)
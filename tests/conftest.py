@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# app은 import할 때 DB를 만들고 이미지 폴더를 쓰므로, 먼저 임시 경로로 돌려 놓는다.
+_workdir = tempfile.mkdtemp(prefix='remempet-test-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_workdir, 'test.db')}")
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_workdir, 'pet_images'))
+os.environ.setdefault('WARMUP_ON_BOOT', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
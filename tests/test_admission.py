@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+import app as remempet
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    monkeypatch.setitem(remempet.app.config, 'UPSTREAM_CONCURRENCY', 1)
+    monkeypatch.setitem(remempet.app.config, 'UPSTREAM_USER_INFLIGHT', 1)
+    monkeypatch.setitem(remempet.app.config, 'ADMISSION_QUEUE_MAX', 2)
+    monkeypatch.setitem(remempet.app.config, 'ADMISSION_QUEUE_TIMEOUT', 2)
+    return remempet.UpstreamGate()
+
+
+def _acquire_in_thread(gate, user_id):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('reason', gate.acquire(user_id)))
+    thread.start()
+    return thread, result
+
+
+def _wait_for_waiters(gate, count):
+    deadline = time.monotonic() + 2
+    while gate.waiting != count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_waiting_request_counts_toward_user_inflight(gate):
+    assert gate.acquire('a') is None
+    thread, result = _acquire_in_thread(gate, 'b')
+    _wait_for_waiters(gate, 1)
+
+    # b가 이미 대기 중이므로 b의 다음 요청은 대기열에 서지 못한다.
+    assert gate.acquire('b') == 'user_inflight'
+    assert gate.waiting == 1
+
+    gate.release('a')
+    thread.join()
+    assert result['reason'] is None
+    gate.release('b')
+    assert gate.per_user == {} and gate.active == 0
+
+
+def test_one_user_cannot_fill_the_queue(gate):
+    assert gate.acquire('a') is None
+    waiters = [_acquire_in_thread(gate, 'b')]
+    _wait_for_waiters(gate, 1)
+    assert gate.acquire('b') == 'user_inflight'
+
+    waiters.append(_acquire_in_thread(gate, 'c'))
+    _wait_for_waiters(gate, 2)
+    assert gate.acquire('d') == 'queue_full'
+
+    # 앞사람이 끝날 때마다 대기열 순서대로 들어간다.
+    for released, (thread, result) in zip('ab', waiters):
+        gate.release(released)
+        thread.join()
+        assert result['reason'] is None
+    gate.release('c')
+    assert gate.per_user == {} and gate.active == 0
+
+
+def test_queue_timeout_releases_the_user_slot(gate, monkeypatch):
+    monkeypatch.setitem(remempet.app.config, 'ADMISSION_QUEUE_TIMEOUT', 0.05)
+    assert gate.acquire('a') is None
+    assert gate.acquire('b') == 'queue_timeout'
+    assert 'b' not in gate.per_user and gate.waiting == 0
+
+    gate.release('a')
+    assert gate.acquire('b') is None
+    gate.release('b')
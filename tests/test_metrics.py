@@ -0,0 +1,44 @@
+import faulthandler
+import gc
+import threading
+import time
+
+import pytest
+
+import app as remempet
+
+
+@pytest.fixture
+def gc_every_allocation():
+    thresholds = gc.get_threshold()
+    gc.set_threshold(1)
+    # 교착되면 테스트가 끝나지 않으므로 스택을 남기고 프로세스를 끝낸다.
+    faulthandler.dump_traceback_later(30, exit=True)
+    try:
+        yield
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+        gc.set_threshold(*thresholds)
+
+
+def test_gc_callback_does_not_deadlock_metrics(gc_every_allocation):
+    client = remempet.app.test_client()
+    stop = time.monotonic() + 1.0
+
+    def scrape():
+        while time.monotonic() < stop:
+            assert client.get('/metrics').status_code == 200
+
+    def allocate():
+        while time.monotonic() < stop:
+            remempet.REQUEST_SECONDS.observe(0.01, f'/endpoint/{len([[] for _ in range(50)])}')
+
+    threads = [threading.Thread(target=scrape, daemon=True), threading.Thread(target=allocate, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+        assert not thread.is_alive()
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'remempet_gc_pause_seconds_count{generation="0"}' in body
@@ -0,0 +1,71 @@
+import pytest
+
+import app as remempet
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """네트워크 없이 호출된 원문을 기록하는 번역기를 끼우고 캐시를 비운다."""
+    calls = []
+    failing = set()
+
+    def fake_translate(text):
+        calls.append(text)
+        if text in failing:
+            raise RuntimeError("fake translator error")
+        return f"en:{text}"
+
+    monkeypatch.setitem(remempet.app.config, 'TRANSLATE_BACKEND', remempet.app.config['TRANSLATE_BACKEND'])
+    monkeypatch.setitem(remempet.TRANSLATE_BACKENDS, 'custom', None)
+    monkeypatch.setattr(remempet, 'translate_stats', dict.fromkeys(remempet.translate_stats, 0))
+    remempet.set_translate_backend(fake_translate)
+    remempet._translate_lru.clear()
+    with remempet.app.app_context():
+        remempet.TranslationCache.query.delete()
+        remempet.db.session.commit()
+        yield calls, failing
+    remempet._translate_lru.clear()
+
+
+def test_repeated_inputs_are_translated_once(backend):
+    calls, _ = backend
+    result = remempet.translate_many(["말티즈", "흰색", " 말티즈 ", "말티즈", "", None])
+    assert result == ["en:말티즈", "en:흰색", "en:말티즈", "en:말티즈", "", ""]
+    assert sorted(calls) == ["말티즈", "흰색"]
+    assert remempet.translate_stats['misses'] == 2
+
+
+def test_memory_then_sqlite_cache(backend):
+    calls, _ = backend
+    remempet.translate_many(["공원"])
+    assert remempet.translate("공원") == "en:공원"
+    assert remempet.translate_stats['memory_hits'] == 1
+
+    # 프로세스 캐시가 비어도(worker 재시작) SQLite에서 찾는다.
+    remempet._translate_lru.clear()
+    assert remempet.translate("공원") == "en:공원"
+    assert remempet.translate_stats['db_hits'] == 1
+    assert calls == ["공원"]
+
+    assert remempet.translate("공원") == "en:공원"
+    assert remempet.translate_stats['memory_hits'] == 2
+
+
+def test_failed_translation_falls_back_and_is_not_cached(backend):
+    calls, failing = backend
+    failing.add("고구마")
+    assert remempet.translate_many(["고구마", "사과"]) == ["고구마", "en:사과"]
+    assert remempet.translate_stats['errors'] == 1
+    assert remempet.TranslationCache.query.filter_by(source="고구마").first() is None
+
+    failing.clear()
+    assert remempet.translate("고구마") == "en:고구마"
+    assert calls.count("고구마") == 2
+
+
+def test_stats_count_each_kind(backend):
+    remempet.translate_many(["바다", "산"])
+    remempet.translate_many(["바다"])
+    remempet._translate_lru.clear()
+    remempet.translate_many(["산", "강"])
+    assert remempet.translate_stats == {'memory_hits': 1, 'db_hits': 1, 'misses': 3, 'errors': 0}
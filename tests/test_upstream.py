@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+import app as remempet
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setitem(remempet.app.config, 'UPSTREAM_RETRIES', 2)
+    monkeypatch.setitem(remempet.app.config, 'UPSTREAM_BACKOFF_MAX', 0)
+    monkeypatch.setitem(remempet.app.config, 'BREAKER_FAILURES', 3)
+    monkeypatch.setitem(remempet.app.config, 'BREAKER_RESET_SECONDS', 30)
+    return remempet.CircuitBreaker('Test')
+
+
+def _stability(breaker, func):
+    return remempet.call_upstream(breaker, func, remempet._stability_retryable, remempet._stability_failure)
+
+
+def _raiser(exc):
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise exc
+    return func, calls
+
+
+def test_read_timeout_counts_as_failure_without_retry(breaker):
+    func, calls = _raiser(requests.exceptions.ReadTimeout("slow"))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _stability(breaker, func)
+    assert len(calls) == 1
+    assert breaker.failures == 1 and breaker.state == 'closed'
+
+
+def test_repeated_read_timeouts_open_the_circuit(breaker):
+    func, calls = _raiser(requests.exceptions.ReadTimeout("slow"))
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            _stability(breaker, func)
+    assert breaker.state == 'open'
+    with pytest.raises(remempet.CircuitOpenError):
+        _stability(breaker, func)
+    assert len(calls) == 3
+
+
+def test_client_error_is_not_a_failure(breaker):
+    breaker.failures = 2
+    func, calls = _raiser(remempet.UpstreamError("bad prompt", status=400))
+    with pytest.raises(remempet.UpstreamError):
+        _stability(breaker, func)
+    assert len(calls) == 1
+    assert breaker.failures == 0 and breaker.state == 'closed'
+
+
+def test_server_error_is_retried_and_counted(breaker):
+    func, calls = _raiser(remempet.UpstreamError("overloaded", status=503))
+    with pytest.raises(remempet.UpstreamError):
+        _stability(breaker, func)
+    assert len(calls) == 3
+    assert breaker.state == 'open'
+
+
+def test_success_after_retry_closes_the_circuit(breaker):
+    results = iter([requests.ConnectionError("reset"), b'png'])
+
+    def func():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    assert _stability(breaker, func) == b'png'
+    assert breaker.failures == 0